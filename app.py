@@ -6,179 +6,147 @@
 #   • Panel Admin recupera las tres opciones: **Añadir**, Desactivar y Rehabilitar.
 # =============================================================================
 import streamlit as st
-import sqlite3
-import numpy as np
+import os
 import random
+import sqlite3
+import time
 import datetime as dt
+from scoring import COLUMNS
+from engine import RULETA_PENALTY, BallotRejected, SHOP, browse_phrases, buy, close_round, ensure_open_round, history, open_round, player_state, run_ruleta, submit_ballot, submit_phrase, touch_round, votes_missing
+from screens import judge_screen
+from db import transaction
+from leagues import Router
+import archive
+import auth
+import bulk
+import ledger
+import cache
+import rating
+import tracing
+
+# TWOWTE_DB: liga principal (o una base de pruebas, loadtest.py);
+# TWOWTE_LEAGUES_DIR: una base más por cada liga adicional (leagues.py)
+DB = os.environ.get("TWOWTE_DB", "game.db")
+LEAGUES_DIR = os.environ.get("TWOWTE_LEAGUES_DIR", "leagues")
+
+# ---------- 1-4. Arranque: una sola vez por proceso del servidor ------------
+@st.cache_resource
+def league_router():
+    # cada liga se abre al pedirla: esquema, seed (solo admin con 0 monedas),
+    # ajustes, ronda abierta y worker de cierre
+    return Router(DB, LEAGUES_DIR, admin=("Jlarriva", "FioreIsQueen"))
+
+
+# liga de la sesión (fijada al entrar) o la de ?liga= en la URL; "" = principal
+league_id = st.session_state.get("league", st.query_params.get("liga", ""))
+try:
+    league = league_router().get(league_id)
+except (LookupError, ValueError) as e:
+    st.error(str(e))
+    st.stop()
 
-DB = "game.db"
-conn = sqlite3.connect(DB, check_same_thread=False)
+# cada hilo de sesión usa sus propias conexiones (WAL): escritura y lectura
+pool = league.pool
+conn = pool.writer()
 c = conn.cursor()
+ro = pool.reader()
+# trazas SQL por sección (apagadas salvo que el admin las active)
+rr = tracing.begin(st.session_state.get("user"), conn, ro)
+get_setting = lambda k: cache.settings(ro)[k]
+set_setting = lambda k, v: (c.execute("REPLACE INTO settings VALUES(?,?)", (k, str(v))), conn.commit(), cache.bump(conn))
 
-# ---------- 1. Esquema de tablas --------------------------------------------
-c.execute("""
-CREATE TABLE IF NOT EXISTS users(
-  username TEXT PRIMARY KEY,
-  password TEXT NOT NULL,
-  role TEXT NOT NULL,            -- 'jugador' | 'juez'
-  is_admin INTEGER NOT NULL,
-  coins INTEGER NOT NULL DEFAULT 0,
-  active INTEGER NOT NULL DEFAULT 1)
-""")
-
-c.execute("CREATE TABLE IF NOT EXISTS settings(clave TEXT PRIMARY KEY, valor TEXT)")
-
-c.execute("""
-CREATE TABLE IF NOT EXISTS rounds(
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  numero INTEGER NOT NULL,
-  status TEXT NOT NULL,
-  created_at TEXT NOT NULL)
-""")
-
-c.execute("""
-CREATE TABLE IF NOT EXISTS frases(
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  texto TEXT NOT NULL,
-  autor TEXT NOT NULL,
-  round_id INTEGER NOT NULL)
-""")
-
-c.execute("""
-CREATE TABLE IF NOT EXISTS votos(
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  juez TEXT NOT NULL,
-  frase_id INTEGER NOT NULL,
-  posicion INTEGER NOT NULL)
-""")
-
-c.execute("""
-CREATE TABLE IF NOT EXISTS player_round(
-  round_id INTEGER NOT NULL,
-  username TEXT NOT NULL,
-  responses_left INTEGER NOT NULL,
-  df_flag INTEGER NOT NULL DEFAULT 0,
-  multiplier INTEGER NOT NULL DEFAULT 1,
-  penalty INTEGER NOT NULL DEFAULT 0,
-  PRIMARY KEY(round_id,username))
-""")
-
-c.execute("""
-CREATE TABLE IF NOT EXISTS purchases(
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  round_id INTEGER NOT NULL,
-  username TEXT NOT NULL,
-  item TEXT NOT NULL,
-  meta TEXT)
-""")
-conn.commit()
-# aseguramos que la columna penalty exista si la tabla venía de versiones previas
-try:
-    c.execute("ALTER TABLE player_round ADD COLUMN penalty INTEGER NOT NULL DEFAULT 0")
-    conn.commit()
-except sqlite3.OperationalError:
-    pass
-
-# ---------- 2. Seed: solo admin con 0 monedas -------------------------------
-if c.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0:
-    c.execute("INSERT INTO users VALUES(?,?,?,?,?,?)", ("Jlarriva", "FioreIsQueen", "juez", 1, 0, 1))
-    conn.commit()
-
-# ---------- 3. Ajustes por defecto ------------------------------------------
-DEFAULTS = {
-  "titulo": "TWOWTE – Reality de Frases",
-  "current_round": "1",
-  "reward_first": "10",
-  "reward_second": "7",
-  "reward_third": "5",
-  "reward_45": "3",
-  "reward_participate": "1"
-}
-for k, v in DEFAULTS.items():
-    c.execute("INSERT OR IGNORE INTO settings VALUES(?,?)", (k, v))
-conn.commit()
-get_setting = lambda k: c.execute("SELECT valor FROM settings WHERE clave=?", (k,)).fetchone()[0]
-set_setting = lambda k, v: (c.execute("REPLACE INTO settings VALUES(?,?)", (k, str(v))), conn.commit())
-
-# ---------- 4. Garantizar ronda abierta -------------------------------------
-current_round = int(get_setting("current_round"))
-open_r = c.execute("SELECT id FROM rounds WHERE numero=? AND status='open'", (current_round,)).fetchone()
-if not open_r:
-    c.execute("INSERT INTO rounds(numero,status,created_at) VALUES(?,?,?)", (current_round, 'open', dt.datetime.utcnow().isoformat()))
-    rid = c.lastrowid
-    players = c.execute("SELECT username FROM users WHERE active=1").fetchall()
-    c.executemany("INSERT INTO player_round(round_id,username,responses_left) VALUES(?,?,1)", [(rid, p[0]) for p in players])
-    conn.commit()
-    open_r = (rid,)
-round_id = open_r[0]
+# ronda abierta (caché de proceso; se invalida al cerrar o reiniciar)
+open_r = cache.open_round(ro)
+round_id, current_round = open_r if open_r else ensure_open_round(conn)
 
 # ---------- 5. Utilidades ----------------------------------------------------
-# Función para cerrar ronda automáticamente cuando todos los jueces han votado
-
-def auto_close_round():
-    global current_round, round_id
-    frases = c.execute("SELECT id, texto, autor FROM frases WHERE round_id=?", (round_id,)).fetchall()
-    if not frases:
-        return
-    N = len(frases)
-    pts = {fid: 0 for fid, _, _ in frases}
-    pos_map = {fid: [] for fid, _, _ in frases}
-    for fid, pos in c.execute(
-        "SELECT frase_id, posicion FROM votos WHERE frase_id IN (SELECT id FROM frases WHERE round_id=? )",
-        (round_id,)):
-        pts[fid] += N + 1 - pos
-        pos_map[fid].append(pos)
-
-    results = []
-    for fid, txt, aut in frases:
-        std = float(np.std(pos_map[fid])) if pos_map[fid] else 0.0
-        pen = c.execute("SELECT penalty FROM player_round WHERE round_id=? AND username=?", (round_id, aut)).fetchone()[0]
-        total = pts[fid] + pen
-        df  = c.execute("SELECT df_flag FROM player_round WHERE round_id=? AND username=?", (round_id, aut)).fetchone()[0]
-        results.append({"Autor": aut, "Puntos": total, "DF": bool(df), "STD": std, "Frase": txt})
-    results.sort(key=lambda r: (r["Puntos"], r["DF"], r["STD"]), reverse=True)
-
-    st.subheader(f"Resultados ronda {current_round}")
-    st.table(results)
-
-    # premios
-    recomp = [int(get_setting("reward_first")), int(get_setting("reward_second")), int(get_setting("reward_third")), int(get_setting("reward_45")), int(get_setting("reward_45"))]
-    orden = [r["Autor"] for r in results]
-    for idx, pl in enumerate(orden):
-        reward = recomp[idx] if idx < len(recomp) else int(get_setting("reward_participate"))
-        mult = c.execute("SELECT multiplier FROM player_round WHERE round_id=? AND username=?", (round_id, pl)).fetchone()[0]
-        c.execute("UPDATE users SET coins = coins + ? WHERE username=?", (reward * mult, pl))
-
-    # Determinar eliminado: peor "mejor" puesto
-    best_pos = {}
-    for idx, auth in enumerate(orden):
-        if auth not in best_pos:
-            best_pos[auth] = idx  # primera aparición (mejor puesto)
-    eliminado = sorted(best_pos.items(), key=lambda x: x[1])[-1][0]
-    c.execute("UPDATE users SET active=0 WHERE username=?", (eliminado,))
-    c.execute("UPDATE rounds SET status='closed' WHERE id=?", (round_id,))
-
-    # preparar nueva ronda
-    next_num = current_round + 1
-    set_setting("current_round", next_num)
-    c.execute("INSERT INTO rounds(numero,status,created_at) VALUES(?,?,?)", (next_num, 'open', dt.datetime.utcnow().isoformat()))
-    new_rid = c.lastrowid
-    activos = c.execute("SELECT username FROM users WHERE active=1").fetchall()
-    c.executemany("INSERT INTO player_round(round_id, username, responses_left) VALUES(?,?,1)", [(new_rid, a[0]) for a in activos])
-    conn.commit()
-
-    round_id = new_rid
-    current_round = next_num
-    st.success(f"Ronda {next_num -1} cerrada automáticamente. Eliminado: {eliminado}. ¡Nueva ronda disponible!")
-
-
 def load_users(active_only=False):
-    q = "SELECT username,password,role,is_admin,coins,active FROM users" + (" WHERE active=1" if active_only else "")
-    return {u[0]: u for u in c.execute(q).fetchall()}
+    # mapa compartido entre sesiones: tratarlo como sólo lectura
+    all_users = cache.users(ro)
+    return {k: u for k, u in all_users.items() if u[4] == 1} if active_only else all_users
 users = load_users()
 
-def total_judges():
-    return sum(1 for u in users.values() if u[2] == 'juez' and u[5] == 1)
+# ---------- Estado de la ronda y fragmentos en vivo --------------------------
+# round_state() guarda en la sesión lo que Acción y Tienda muestran al usuario
+# (respuestas, compra, saldo, autores) y sólo lo recarga, en una consulta,
+# cuando cambia rounds.rev; las escrituras propias lo actualizan en su sitio.
+# Un rerun sin cambios hace una única consulta: la revisión, y ni eso si se
+# comprobó hace menos de STATE_FRESH_SECONDS (varias llamadas en un rerun).
+# Pendientes, votos que faltan y saldo se refrescan solos cada LIVE_SECONDS
+# sin rerun completo, con el mismo estado.
+LIVE_SECONDS = 5
+STATE_FRESH_SECONDS = 1.0
+
+def round_state(rconn):
+    """Estado (ronda, usuario) de la sesión, válido mientras no cambie rounds.rev."""
+    state = st.session_state.get("round_state")
+    now = time.monotonic()
+    if state and state["key"][:2] == (round_id, username) and now - state["checked"] < STATE_FRESH_SECONDS:
+        return state
+    row = rconn.execute("SELECT rev, status FROM rounds WHERE id=?", (round_id,)).fetchone()
+    if not row or row[1] != 'open':
+        # ronda cerrada o reiniciada: la app entera pasa a la nueva; se invalida
+        # la caché por si el cierre vino de otro proceso y aún la daba abierta
+        cache.bump(rconn)
+        st.rerun()
+    if not state or state["key"] != (round_id, username, row[0]):
+        state = player_state(rconn, round_id, username)
+        state["key"] = (round_id, username, state["rev"])
+    state["checked"] = now
+    st.session_state["round_state"] = state
+    return state
+
+def wrote(**changes):
+    """Aplica al estado una escritura propia (que subió rounds.rev en 1)."""
+    state = st.session_state["round_state"]
+    state.update(changes)
+    state["key"] = (round_id, username, state["key"][2] + 1)  # si otro escribió también, no coincidirá y se recarga
+
+def live(name, load):
+    """load(conn, estado) memorizado en la sesión por (ronda, usuario, revisión)."""
+    rconn = pool.reader()  # el refresco corre en otro hilo: su propia conexión
+    state = round_state(rconn)
+    key = f"live_{name}"
+    hit = st.session_state.get(key)
+    if hit and hit[0] == state["key"]:
+        return hit[1]
+    value = load(rconn, state)
+    st.session_state[key] = (state["key"], value)
+    return value
+
+def _pendientes(rconn, state):
+    if len(state["authors"]) < 2:
+        return None
+    faltan = [u for u, info in cache.users(rconn).items() if info[4] == 1 and info[2] == 'jugador' and u not in state["authors"]]
+    random.shuffle(faltan)
+    return faltan
+
+def _votos(rconn, state):
+    if not state["authors"]:
+        return None
+    return votes_missing(rconn, round_id)
+
+@st.fragment(run_every=LIVE_SECONDS)
+def pendientes():
+    faltan = live("pendientes", _pendientes)
+    if faltan is not None:
+        st.write("Pendientes:", ", ".join(faltan) if faltan else "Todos han enviado")
+
+@st.fragment(run_every=LIVE_SECONDS)
+def estado_votos():
+    faltan = live("votos", _votos)
+    if faltan is None:
+        st.info("Aún no hay frases enviadas.")
+    elif faltan > 0:
+        st.info(f"Faltan votos de {faltan} juez(es).")
+    else:
+        # el cierre lo hace el worker; avisar de nuevo es inocuo (compare-and-set)
+        league_router().notify(league_id, round_id)
+        st.info("Todos los jueces han votado: la ronda se está cerrando…")
+
+@st.fragment(run_every=LIVE_SECONDS)
+def saldo():
+    st.write(f"Monedas: **{round_state(pool.reader())['balance']}**")
 
 # ---------- 6. Streamlit & sesión -------------------------------------------
 st.set_page_config(page_title="TWOWTE", page_icon="📝", layout="centered")
@@ -189,18 +157,35 @@ if 'user' not in st.session_state:
 st.title(get_setting("titulo"))
 
 # --- Login
-if not st.session_state['user']:
-    st.sidebar.header("Login")
-    u = st.sidebar.text_input("Usuario")
-    p = st.sidebar.text_input("Contraseña", type="password")
-    if st.sidebar.button("Entrar"):
-        if u in users and users[u][1] == p and users[u][5] == 1:
-            st.session_state['user'] = u
-            st.session_state['is_admin'] = bool(users[u][3])
-            st.rerun()
-        else:
-            st.sidebar.error("Credenciales incorrectas o cuenta inactiva")
-    st.stop()
+with rr.section("Login"):
+    # token caducado o revocado (cuenta desactivada, reinicio): volver a entrar
+    if st.session_state['user'] and auth.check(st.session_state.get('token'), league_id) != (
+            st.session_state['user'], st.session_state['is_admin']):
+        st.session_state['user'] = None
+        st.session_state['is_admin'] = False
+    if not st.session_state['user']:
+        st.sidebar.header("Login")
+        u = st.sidebar.text_input("Usuario")
+        p = st.sidebar.text_input("Contraseña", type="password")
+        liga = st.sidebar.text_input("Liga (vacío = principal)", league_id).strip()
+        if st.sidebar.button("Entrar"):
+            try:
+                target = league_router().get(liga)
+            except (LookupError, ValueError) as e:
+                st.sidebar.error(str(e))
+                st.stop()
+            # el login siempre contra la base de la liga, nunca contra la caché
+            session = auth.login(target.pool.writer(), liga, u, p)
+            if session:
+                st.session_state['user'] = u
+                st.session_state['token'], st.session_state['is_admin'] = session
+                st.session_state['league'] = liga
+                if liga:
+                    st.query_params["liga"] = liga
+                st.rerun()
+            else:
+                st.sidebar.error("Credenciales incorrectas o cuenta inactiva")
+        st.stop()
 
 # ---------- 7. Tabs ----------------------------------------------------------
 base_tabs = ["Acción", "Tienda", "Resultados", "Historial"]
@@ -214,55 +199,57 @@ is_admin = st.session_state['is_admin']
 ###############################################################################
 # ACCIÓN                                                                      #
 ###############################################################################
-with tabs[0]:
-    # Botón para refrescar sin cerrar sesión
-    if st.button("🔄 Recargar valores"):
-        st.rerun()
-
+with tabs[0], rr.section("Acción"):
     role = users[username][2]
     if role == 'juez':
         st.info("Eres juez: no envías frases, solo votas.")
-        # Interfaz de votación para jueces
-        frases_j = c.execute("SELECT id, texto FROM frases WHERE round_id=?", (round_id,)).fetchall()
+        # Interfaz de votación para jueces (modo pantallas si screen_size > 0)
+        screen_size = int(get_setting("screen_size"))
+        if screen_size > 0:
+            frases_j = judge_screen(conn, round_id, username, screen_size)
+        else:
+            frases_j = ro.execute("SELECT id, texto FROM frases WHERE round_id=?", (round_id,)).fetchall()
         if not frases_j:
             st.warning("Aún no hay frases para votar.")
         else:
-            labels = [txt for _, txt in frases_j]
-            id_map = {txt: fid for fid, txt in frases_j}
-            ranking = st.multiselect("Ordena de mejor a peor", labels, default=[], key="rank")
+            # opciones por id: dos frases con el mismo texto no se confunden;
+            # la clave por ronda evita arrastrar ids de la ronda anterior
+            labels = dict(frases_j)
+            ranking = st.multiselect("Ordena de mejor a peor", list(labels), default=[], format_func=labels.get, key=f"rank_{round_id}")
             if len(ranking) == len(labels):
                 if st.button("Enviar voto"):
-                    c.execute("DELETE FROM votos WHERE juez=? AND frase_id IN (SELECT id FROM frases WHERE round_id=? )", (username, round_id))
-                    for pos, label in enumerate(ranking, 1):
-                        fid = id_map[label]
-                        c.execute("INSERT INTO votos(juez, frase_id, posicion) VALUES(?,?,?)", (username, fid, pos))
-                    conn.commit(); st.success("Voto registrado")
+                    try:
+                        ready = submit_ballot(conn, round_id, username, ranking, screen_size > 0)
+                    except BallotRejected as e:
+                        st.error(str(e))
+                    else:
+                        st.success("Voto registrado")
+                        if ready:
+                            league_router().notify(league_id, round_id)
             else:
                 st.info("Selecciona todas las frases para completar el ranking.")
     else:
         # Formulario de envío para jugadores
-        pr_state = c.execute("SELECT responses_left FROM player_round WHERE round_id=? AND username=?", (round_id, username)).fetchone()
-        if not pr_state:
+        state = round_state(ro)
+        left = state["responses_left"]
+        if left is None:
             st.error("No participas en esta ronda.")
         else:
-            left = pr_state[0]
             st.info(f"Respuestas restantes: {left}")
             if left > 0:
                 frase_txt = st.text_input("Tu frase:")
                 if st.button("Enviar frase") and frase_txt.strip():
-                    c.execute("INSERT INTO frases(texto, autor, round_id) VALUES(?,?,?)", (frase_txt.strip(), username, round_id))
-                    c.execute("UPDATE player_round SET responses_left = responses_left - 1 WHERE round_id=? AND username=?", (round_id, username))
-                    conn.commit(); st.success("Frase enviada"); st.rerun()
-            enviados = set(x[0] for x in c.execute("SELECT DISTINCT autor FROM frases WHERE round_id=?", (round_id,)))
-            if len(enviados) >= 2:
-                faltan = [u for u in users if users[u][5] == 1 and users[u][2] == 'jugador' and u not in enviados]
-                random.shuffle(faltan)
-                st.write("Pendientes:", ", ".join(faltan) if faltan else "Todos han enviado")
+                    error = submit_phrase(conn, round_id, username, frase_txt.strip(), int(get_setting("screen_size")) > 0)
+                    if error:
+                        st.error(error)
+                    else:
+                        wrote(responses_left=left - 1, authors=state["authors"] | {username})
+                        st.success("Frase enviada"); st.rerun()
+            pendientes()
 
 # TIENDA                                                                      #
 ###############################################################################
-SHOP = {"Doble Respuesta": 10, "Triple Respuesta": 25, "Desempate Favorable": 8, "Ruleta del Tigre": 9, "Duplicador de Monedas": 12}
-with tabs[1]:
+with tabs[1], rr.section("Tienda"):
     # Manejo de Ruleta pendiente
     if st.session_state.get("pending_ruleta", False) and st.session_state.get("ruleta_buyer") == username:
         st.subheader("Configurar Ruleta del Tigre")
@@ -270,18 +257,15 @@ with tabs[1]:
         r2 = st.text_input("Jugador 2")
         if st.button("Ejecutar Ruleta"):
             users = load_users()
-            valid = all(r in users and users[r][5] == 1 for r in [r1, r2]) and r1 != r2 and r1 not in ["", username] and r2 not in ["", username]
+            valid = all(r in users and users[r][4] == 1 for r in [r1, r2]) and r1 != r2 and r1 not in ["", username] and r2 not in ["", username]
             if valid:
-                price = SHOP["Ruleta del Tigre"]
-                coins_user = c.execute("SELECT coins FROM users WHERE username=?", (username,)).fetchone()[0]
-                if coins_user < price:
-                    st.error("Monedas insuficientes")
+                try:
+                    loser = run_ruleta(conn, username, round_id, r1, r2)
+                except ledger.PurchaseRejected as e:
+                    st.error(str(e))
                 else:
-                    loser = random.choice([username, r1, r2])
-                    c.execute("UPDATE users SET coins = coins - 3 WHERE username=?", (loser,))
-                    c.execute("UPDATE users SET coins = coins - ? WHERE username=?", (price, username))
-                    c.execute("INSERT INTO purchases(round_id, username, item, meta) VALUES(?,?,?,?)", (round_id, username, "Ruleta del Tigre", f"{r1}|{r2}"))
-                    conn.commit()
+                    balance = round_state(ro)["balance"] - SHOP["Ruleta del Tigre"] - (RULETA_PENALTY if loser == username else 0)
+                    wrote(bought="Ruleta del Tigre", balance=balance)
                     st.success(f"Perdedor: {loser}")
                     # reset flags
                     st.session_state["pending_ruleta"] = False
@@ -291,108 +275,79 @@ with tabs[1]:
                 st.error("Jugadores inválidos o repetidos")
         st.stop()
 
-    row_coins = c.execute("SELECT coins FROM users WHERE username=?", (username,)).fetchone()
-    coins = row_coins[0] if row_coins else 0
-    st.write(f"Monedas: **{coins}**")
-    bought = c.execute("SELECT item FROM purchases WHERE round_id=? AND username=?", (round_id, username)).fetchone()
-    if bought:
-        st.info(f"Ya compraste {bought[0]} esta ronda.")
+    saldo()
+    state = round_state(ro)
+    if state["bought"]:
+        st.info(f"Ya compraste {state['bought']} esta ronda.")
     else:
         for itm, price in SHOP.items():
             colA, colB = st.columns([3, 1])
             colA.write(f"**{itm}** – {price} monedas")
             if colB.button(f"Comprar {itm}"):
-                if coins < price:
+                if itm == "Ruleta del Tigre" and state["balance"] < price:
                     st.error("Monedas insuficientes")
+                elif itm == "Ruleta del Tigre":
+                    # guardar estado en sesión y pedir nombres en nuevo render
+                    st.session_state["pending_ruleta"] = True
+                    st.session_state["ruleta_buyer"] = username
+                    st.rerun()
                 else:
-                    # efectos inmediatos
-                    if itm == "Doble Respuesta":
-                        c.execute("UPDATE player_round SET responses_left = responses_left + 1 WHERE round_id=? AND username=?", (round_id, username))
-                    elif itm == "Triple Respuesta":
-                        c.execute("UPDATE player_round SET responses_left = responses_left + 2 WHERE round_id=? AND username=?", (round_id, username))
-                    elif itm == "Desempate Favorable":
-                        c.execute("UPDATE player_round SET df_flag = 1 WHERE round_id=? AND username=?", (round_id, username))
-                    elif itm == "Duplicador de Monedas":
-                        c.execute("UPDATE player_round SET multiplier = 2 WHERE round_id=? AND username=?", (round_id, username))
-                    elif itm == "Ruleta del Tigre":
-                        # guardar estado en sesión y pedir nombres en nuevo render
-                        st.session_state["pending_ruleta"] = True
-                        st.session_state["ruleta_buyer"] = username
-                        st.rerun()
-                    # Cobrar y registrar compra (genérico para otros ítems)
-                    c.execute("UPDATE users SET coins = coins - ? WHERE username=?", (price, username))
-                    c.execute("INSERT INTO purchases(round_id, username, item) VALUES(?,?,?)", (round_id, username, itm))
-                    conn.commit(); st.success("Compra aplicada"); st.rerun()
+                    try:
+                        # cobro condicional, registro y efecto en una sola transacción
+                        left = buy(conn, username, round_id, itm)
+                    except ledger.PurchaseRejected as e:
+                        st.error(str(e))
+                    else:
+                        wrote(bought=itm, balance=state["balance"] - price, responses_left=left)
+                        st.success("Compra aplicada"); st.rerun()
 
 ###############################################################################
 # RESULTADOS                                                                  #
 ###############################################################################
-with tabs[2]:
-    enviados = c.execute("SELECT COUNT(DISTINCT autor) FROM frases WHERE round_id=?", (round_id,)).fetchone()[0]
-    if enviados == 0:
-        st.info("Aún no hay frases enviadas.")
+with tabs[2], rr.section("Resultados"):
+    estado_votos()
+
+    # ---- Resultados de la última ronda cerrada (materializados al cerrar) ----
+    last = cache.last_results(ro)
+    if last:
+        st.subheader(f"Resultados ronda {last[0]}")
+        st.table([dict(zip(COLUMNS, (a, p, bool(d), s, t))) for a, p, d, s, t in last[1]])
+
+with tabs[3], rr.section("Historial"):
+    # --- Historial de rondas (agregados materializados al cerrar) ---
+    st.table(cache.derived(ro, "history", lambda: history(ro)))
+
+    # --- Frases de rondas cerradas: búsqueda FTS y páginas por cursor ---
+    st.subheader("Frases de rondas anteriores")
+    col_q, col_a, col_n = st.columns([3, 2, 1])
+    q = col_q.text_input("Buscar frase")
+    autor_f = col_a.selectbox("Autor", ["(todos)"] + sorted(u for u in users if users[u][2] == 'jugador'))
+    numero_f = col_n.number_input("Ronda (0 = todas)", min_value=0, value=0, step=1)
+    filtros = (q, autor_f, numero_f)
+    # al cambiar los filtros se vuelve a la primera página
+    if st.session_state.get("frases_filtros") != filtros:
+        st.session_state["frases_filtros"] = filtros
+        st.session_state["frases_cursores"] = [None]
+    cursores = st.session_state["frases_cursores"]
+    browse = lambda: browse_phrases(ro, q, None if autor_f == "(todos)" else autor_f, int(numero_f), cursores[-1])
+    # la primera página sin filtros es la de casi todos los reruns: compartida
+    filas, siguiente = cache.derived(ro, "phrases_first", browse) if not (q or numero_f or cursores[-1] or autor_f != "(todos)") else browse()
+    if filas:
+        st.dataframe(filas, hide_index=True)
     else:
-        need = total_judges()
-        got = c.execute(
-            "SELECT COUNT(DISTINCT juez) FROM votos WHERE frase_id IN (SELECT id FROM frases WHERE round_id=? )",
-            (round_id,)).fetchone()[0]
-        if got < need:
-            st.info(f"Faltan votos de {need - got} juez(es).")
-        else:
-            # Cierre automático si la ronda sigue abierta
-            if c.execute("SELECT status FROM rounds WHERE id=?", (round_id,)).fetchone()[0] == 'open':
-                auto_close_round()
-
-            # ---- Mostrar resultados finales ----
-            frases = c.execute("SELECT id, texto, autor FROM frases WHERE round_id=?", (round_id,)).fetchall()
-            N = len(frases)
-            pts = {fid: 0 for fid, _, _ in frases}
-            pos_list = {fid: [] for fid, _, _ in frases}
-            for fid, pos in c.execute(
-                "SELECT frase_id, posicion FROM votos WHERE frase_id IN (SELECT id FROM frases WHERE round_id=? )",
-                (round_id,)):
-                pts[fid] += N + 1 - pos
-                pos_list[fid].append(pos)
-            results = []
-            for fid, txt, aut in frases:
-                std = float(np.std(pos_list[fid])) if pos_list[fid] else 0.0
-                df = c.execute("SELECT df_flag FROM player_round WHERE round_id=? AND username=?", (round_id, aut)).fetchone()[0]
-                pen = c.execute("SELECT penalty FROM player_round WHERE round_id=? AND username=?", (round_id, aut)).fetchone()[0]
-                total_pts = pts[fid] + pen  # sumar penalizaciones negativas o positivas
-                results.append({"Autor": aut, "Puntos": total_pts, "DF": bool(df), "STD": std, "Frase": txt})
-            results.sort(key=lambda r: (r["Puntos"], r["DF"], r["STD"]), reverse=True)
-            st.table(results)
-
-with tabs[3]:
-    # --- Historial de rondas ---
-    closed = c.execute("SELECT id, numero FROM rounds WHERE status='closed' ORDER BY numero").fetchall()
-    wins = {u: 0 for u in users}
-    avgs = {u: [] for u in users}
-    for rid, num in closed:
-        fr = c.execute("SELECT id, autor FROM frases WHERE round_id=?", (rid,)).fetchall()
-        N = len(fr)
-        pts = {a: 0 for _, a in fr}
-        for fid, pos in c.execute("SELECT frase_id, posicion FROM votos WHERE frase_id IN (SELECT id FROM frases WHERE round_id=? )", (rid,)):
-            aut = c.execute("SELECT autor FROM frases WHERE id=?", (fid,)).fetchone()[0]
-            pts[aut] += N + 1 - pos
-        if pts:
-            ranking = sorted(pts, key=pts.get, reverse=True)
-            wins[ranking[0]] += 1
-            for rk, p in enumerate(ranking, 1):
-                avgs[p].append(rk)
-    # Estadísticas de jugadores (sin jueces)
-    stats = [{
-        "Jugador": u,
-        "Victorias": wins[u],
-        "Promedio": round(np.mean(avgs[u]), 2) if avgs[u] else "-"
-    } for u in users if users[u][2] == 'jugador']
-    st.table(stats)
+        st.info("No hay frases que coincidan.")
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    if col_prev.button("← Anteriores", disabled=len(cursores) == 1):
+        cursores.pop(); st.rerun()
+    col_page.caption(f"Página {len(cursores)}")
+    if col_next.button("Siguientes →", disabled=siguiente is None):
+        cursores.append(siguiente); st.rerun()
 
 ###############################################################################
 # ADMIN                                                                       #
 ###############################################################################
 if is_admin:
-    with tabs[-1]:
+    with tabs[-1], rr.section("Admin"):
         st.header("Panel Admin")
         # --- Notificación de Ruleta del Tigre comprada esta ronda ---
         ruletas = c.execute("SELECT username, meta FROM purchases WHERE round_id=? AND item='Ruleta del Tigre'", (round_id,)).fetchall()
@@ -419,27 +374,64 @@ if is_admin:
             elif not new_user or not new_pass:
                 st.error("Usuario y contraseña obligatorios")
             else:
-                c.execute("INSERT INTO users VALUES(?,?,?,?,?,?)", (new_user, new_pass, new_role, 0, 0, 1))
+                c.execute("INSERT INTO users VALUES(?,?,?,?,?)", (new_user, auth.hash_password(new_pass), new_role, 0, 1))
                 # también agregar a ronda actual
                 c.execute("INSERT INTO player_round(round_id, username, responses_left) VALUES(?,?,1)", (round_id, new_user))
-                conn.commit(); st.success("Jugador añadido"); st.rerun()
+                touch_round(conn, round_id); conn.commit(); cache.bump(conn); st.success("Jugador añadido"); st.rerun()
 
         st.markdown("---")
         # Desactivar / habilitar
         colA, colB = st.columns(2)
         with colA:
-            des = st.selectbox("Desactivar", [u for u in users if users[u][5] == 1])
+            des = st.selectbox("Desactivar", [u for u in users if users[u][4] == 1])
             if st.button("Desactivar"):
                 c.execute("UPDATE users SET active=0 WHERE username=?", (des,))
-                conn.commit(); st.success("Desactivado"); st.rerun()
+                touch_round(conn, round_id); conn.commit(); cache.bump(conn); auth.revoke(league_id, [des])
+                st.success("Desactivado"); st.rerun()
         with colB:
-            reh = st.selectbox("Rehabilitar", [u for u in users if users[u][5] == 0])
+            reh = st.selectbox("Rehabilitar", [u for u in users if users[u][4] == 0])
             if st.button("Rehabilitar"):
                 c.execute("UPDATE users SET active=1 WHERE username=?", (reh,))
                 # añadir al player_round si no existe para ronda actual
                 if not c.execute("SELECT 1 FROM player_round WHERE round_id=? AND username=?", (round_id, reh)).fetchone():
                     c.execute("INSERT INTO player_round(round_id, username, responses_left) VALUES(?,?,1)", (round_id, reh))
-                conn.commit(); st.success("Rehabilitado"); st.rerun()
+                touch_round(conn, round_id); conn.commit(); cache.bump(conn); st.success("Rehabilitado"); st.rerun()
+
+        st.markdown("---")
+        # Operaciones masivas: el CSV se valida entero y se aplica en una transacción
+        st.subheader("Operaciones masivas (CSV)")
+        BULK = {
+            "Alta de usuarios (username, password, role)": (lambda data: bulk.parse_users(ro, data), bulk.apply_users),
+            "Ajustes (username, monedas, penalizacion, respuestas)":
+                (lambda data: bulk.parse_adjustments(ro, data, round_id), bulk.apply_adjustments),
+            "Desactivar (username)": (lambda data: bulk.parse_deactivations(ro, data), bulk.apply_deactivations),
+        }
+        if "bulk_msg" in st.session_state:
+            st.success(st.session_state.pop("bulk_msg"))
+        op = st.selectbox("Operación", list(BULK))
+        # la clave cambia tras aplicar para vaciar el uploader
+        upload = st.file_uploader("Fichero CSV", type="csv", key=f"bulk_{st.session_state.get('bulk_nonce', 0)}")
+        if upload is not None:
+            parse, apply = BULK[op]
+            rows, errors = parse(upload.getvalue())
+            if errors:
+                st.error(f"{len(errors)} errores; no se aplica nada:\n\n" + "\n\n".join(errors[:20]))
+            elif not rows:
+                st.warning("El fichero no tiene filas que aplicar.")
+            else:
+                st.write(f"{len(rows)} filas válidas.")
+                if st.button("Aplicar CSV"):
+                    try:
+                        n = apply(conn, rows, round_id)
+                    except sqlite3.IntegrityError as e:
+                        # otro admin cambió los usuarios entre validar y aplicar
+                        st.error(f"No se aplicó nada: {e}"); st.stop()
+                    cache.bump(conn)
+                    if apply is bulk.apply_deactivations:
+                        auth.revoke(league_id, rows)
+                    st.session_state["bulk_msg"] = f"{op.split(' (')[0]}: {n} filas aplicadas"
+                    st.session_state["bulk_nonce"] = st.session_state.get("bulk_nonce", 0) + 1
+                    st.rerun()
 
         st.markdown("---")
         # Recompensas configurables
@@ -452,6 +444,35 @@ if is_admin:
             set_setting("reward_first", r1); set_setting("reward_second", r2); set_setting("reward_third", r3); set_setting("reward_45", r45)
             st.success("Recompensas guardadas")
 
+        st.markdown("---")
+        # Rating Elo: cambiar K recalcula la temporada entera desde round_results
+        new_rk = st.number_input("K del rating", min_value=1, value=int(float(get_setting("rating_k"))), step=1)
+        if st.button("Guardar K y recalcular ratings"):
+            with transaction(conn):
+                conn.execute("REPLACE INTO settings VALUES('rating_k',?)", (str(int(new_rk)),))
+                rounds_replayed = rating.rebuild(conn, int(new_rk))
+            cache.bump(conn)
+            st.success(f"Ratings recalculados ({rounds_replayed} rondas)")
+
+        st.markdown("---")
+        # Archivo frío: frases, votos y compras de rondas viejas fuera de las tablas calientes
+        st.subheader("Archivo de rondas")
+        keep = st.number_input("Rondas cerradas sin archivar", min_value=0, value=int(get_setting("archive_keep")), step=1)
+        if st.button("Guardar y archivar ahora"):
+            set_setting("archive_keep", int(keep))
+            st.success(f"{archive.archive_rounds(conn, int(keep))} rondas archivadas")
+        # COUNT(*) recorre las tablas enteras: sólo a petición, no en cada rerun
+        if st.button("Contar filas calientes y archivadas"):
+            st.dataframe([{"Tabla": t, "Calientes": hot, "Archivadas": cold}
+                          for t, (hot, cold) in archive.counts(conn).items()], hide_index=True)
+
+        st.markdown("---")
+        # Modo pantallas: cada juez ordena sólo k frases (0 = ranking completo)
+        new_k = st.number_input("Frases por pantalla de juez (0 = todas)", min_value=0, value=int(get_setting("screen_size")), step=1)
+        if st.button("Guardar modo de votación"):
+            set_setting("screen_size", int(new_k))
+            st.success("Modo de votación guardado (aplica a las pantallas que aún no se han generado)")
+
         st.markdown("---")
         # Ajustar monedas, penalización y respuestas
         st.subheader("Ajustar parámetros de jugador")
@@ -461,12 +482,12 @@ if is_admin:
         delta_resp = st.number_input("± Respuestas restantes", value=0, step=1, format="%d")
         if st.button("Aplicar ajustes"):
             if delta_coins:
-                c.execute("UPDATE users SET coins = coins + ? WHERE username=?", (delta_coins, sel_user))
+                ledger.append(conn, [(sel_user, int(delta_coins), "ajuste admin")], round_id)
             if delta_pen:
                 c.execute("UPDATE player_round SET penalty = penalty + ? WHERE round_id=? AND username=?", (delta_pen, round_id, sel_user))
             if delta_resp:
                 c.execute("UPDATE player_round SET responses_left = responses_left + ? WHERE round_id=? AND username=?", (delta_resp, round_id, sel_user))
-            conn.commit(); st.success("Ajustes aplicados"); st.rerun()
+            touch_round(conn, round_id); conn.commit(); cache.bump(conn); st.success("Ajustes aplicados"); st.rerun()
 
         st.markdown("---")
         # --- Reinicio TOTAL de la base de datos ---
@@ -474,59 +495,80 @@ if is_admin:
         confirm = st.checkbox("⚠️ Confirmo reinicio completo (esto borra TODO)")
         if st.button("Ejecutar reinicio"):
             if confirm:
-                tables = ["frases", "votos", "rounds", "purchases", "player_round", "users"]
+                archive.purge(conn)
+                tables = ["frases", "ballots", "screens", "judge_screens", "coin_ledger", "coin_balances", "rounds", "purchases", "player_round", "round_results", "player_stats", "users"]
                 for tbl in tables:
                     if tbl == "users":
                         c.execute("DELETE FROM users WHERE username <> 'Jlarriva'")
                     else:
                         c.execute(f"DELETE FROM {tbl}")
-                set_setting("current_round", 1)
-                # crear ronda 1 y reiniciar ajustes temporales
-                c.execute("INSERT INTO rounds(numero,status,created_at) VALUES(1,'open',?)", (dt.datetime.utcnow().isoformat(),))
-                new_rid = c.lastrowid
-                c.execute("INSERT INTO player_round(round_id, username, responses_left) VALUES(?,?,1)", (new_rid, 'Jlarriva'))
-                conn.commit()
+                # crear ronda 1 (sólo con la cuenta admin)
+                open_round(conn, 1)
+                conn.commit(); cache.bump(conn)
+                auth.revoke(league_id, [u for u in users if u != 'Jlarriva'])
                 st.success("Base reiniciada. Solo la cuenta admin permanece. Recarga la página.")
                 st.rerun()
             else:
                 st.error("Marca la casilla de confirmación primero.")
         st.markdown("---")
+        # Fecha límite: el worker cierra la ronda aunque nadie abra la página
+        st.subheader("Fecha límite de la ronda (UTC)")
+        deadline = ro.execute("SELECT deadline FROM rounds WHERE id=?", (round_id,)).fetchone()[0]
+        st.write(f"Actual: {deadline or 'sin fecha límite'}")
+        colD, colT = st.columns(2)
+        d_date = colD.date_input("Fecha", dt.datetime.utcnow().date())
+        d_time = colT.time_input("Hora", dt.time(23, 59))
+        colS, colQ = st.columns(2)
+        if colS.button("Programar cierre"):
+            c.execute("UPDATE rounds SET deadline=? WHERE id=?", (dt.datetime.combine(d_date, d_time).isoformat(), round_id))
+            conn.commit(); st.success("Fecha límite guardada"); st.rerun()
+        if colQ.button("Quitar fecha límite"):
+            c.execute("UPDATE rounds SET deadline=NULL WHERE id=?", (round_id,))
+            conn.commit(); st.success("Fecha límite eliminada"); st.rerun()
+        st.markdown("---")
+        # Ligas: cada una con su propia base; sólo se crean desde la principal
+        if not league_id:
+            st.subheader("Ligas")
+            router = league_router()
+            st.write(f"Ligas: {', '.join(router.known()) or 'ninguna'} "
+                     f"(abiertas ahora: {router.open_count()} de {router.max_open})")
+            new_league = st.text_input("Nueva liga (a-z, 0-9, _ y -; se entra con ?liga=nombre)").strip()
+            if st.button("Crear liga"):
+                try:
+                    if new_league in router.known():
+                        st.error("La liga ya existe")
+                    else:
+                        router.get(new_league, create=True)
+                        st.success(f"Liga {new_league} creada con la cuenta admin")
+                except ValueError as e:
+                    st.error(str(e))
+            st.markdown("---")
+        # Rendimiento: consultas y tiempos por sección de los últimos reruns
+        st.subheader("Rendimiento (trazas SQL)")
+        st.checkbox("Trazar consultas de todas las sesiones", value=tracing.enabled, key="trace_on",
+                    on_change=lambda: tracing.set_enabled(st.session_state["trace_on"]))
+        if tracing.enabled:
+            traces = tracing.summary(exclude=getattr(rr, "record", None))
+            st.caption(f"Últimos {traces['reruns']} reruns (máx. {tracing.RING_SIZE}). El tiempo de cada "
+                       "sentencia incluye leer sus filas; las muy cortas cuentan como 0.")
+            if traces["sections"]:
+                st.table(traces["sections"])
+            if traces["slowest"]:
+                st.write("Sentencias más lentas")
+                st.table(traces["slowest"])
+            if traces["repeats"]:
+                st.warning(f"Sentencias repetidas {tracing.REPEAT_THRESHOLD}+ veces en una sección (posible N+1)")
+                st.table(traces["repeats"])
+            if st.button("Vaciar trazas"):
+                tracing.clear(); st.rerun()
+        st.markdown("---")
         # Cerrar ronda
         if st.button("Cerrar ronda y otorgar premios"):
-            frases = c.execute("SELECT id, autor FROM frases WHERE round_id=?", (round_id,)).fetchall()
-            if not frases:
-                st.error("Sin frases para esta ronda")
+            closed = close_round(conn, round_id)
+            if not closed:
+                st.error("Sin frases para esta ronda o ya estaba cerrada")
             else:
-                N = len(frases)
-                pts = {a: 0 for _, a in frases}
-                for fid, pos in c.execute("SELECT frase_id, posicion FROM votos WHERE frase_id IN (SELECT id FROM frases WHERE round_id=? )", (round_id,)):
-                    aut = c.execute("SELECT autor FROM frases WHERE id=?", (fid,)).fetchone()[0]
-                    pts[aut] += N + 1 - pos
-                ord_list = sorted(pts, key=pts.get, reverse=True)
-                rewards = [
-                    int(get_setting("reward_first")),
-                    int(get_setting("reward_second")),
-                    int(get_setting("reward_third")),
-                    int(get_setting("reward_45")),
-                    int(get_setting("reward_45"))
-                ]
-                for idx, pl in enumerate(ord_list):
-                    reward = rewards[idx] if idx < len(rewards) else int(get_setting("reward_participate"))
-                    mult = c.execute("SELECT multiplier FROM player_round WHERE round_id=? AND username=?", (round_id, pl)).fetchone()[0]
-                    c.execute("UPDATE users SET coins = coins + ? WHERE username=?", (reward * mult, pl))
-                best_pos = {}
-                for idx, au in enumerate(ord_list):
-                    if au not in best_pos:
-                        best_pos[au] = idx
-                eliminado = sorted(best_pos.items(), key=lambda x: x[1])[-1][0]
-                c.execute("UPDATE users SET active=0 WHERE username=?", (eliminado,))
-                c.execute("UPDATE rounds SET status='closed' WHERE id=?", (round_id,))
-                next_num = current_round + 1
-                set_setting("current_round", next_num)
-                c.execute("INSERT INTO rounds(numero,status,created_at) VALUES(?,?,?)", (next_num, 'open', dt.datetime.utcnow().isoformat()))
-                new_rid = c.lastrowid
-                activos = c.execute("SELECT username FROM users WHERE active=1").fetchall()
-                c.executemany("INSERT INTO player_round(round_id, username, responses_left) VALUES(?,?,1)", [(new_rid, a[0]) for a in activos])
-                conn.commit()
+                _, eliminado, next_num = closed
+                archive.after_close(conn)  # igual que los cierres del worker
                 st.success(f"Ronda cerrada. Eliminado: {eliminado}. Ronda {next_num} abierta.")
                 st.rerun()
@@ -0,0 +1,236 @@
+# TWOWTE – Archivo frío de rondas y exportación de temporadas
+# =============================================================================
+# Las tablas calientes (frases, ballots, pantallas, player_round, purchases)
+# sólo necesitan la ronda abierta y las últimas cerradas: lo que se lee de
+# rondas viejas (Resultados, Historial, rating) sale de round_results y
+# player_stats. archive_rounds() pasa las rondas cerradas más antiguas a una
+# base adjunta (<base>.archive.db, alias cold) y, de paso, los movimientos de
+# coin_ledger que ya recoge la foto de coin_balances.
+#
+# En WAL una transacción sobre dos bases no es atómica en conjunto, así que se
+# hace en dos pasos: copiar a cold (INSERT OR IGNORE, repetible) y, ya
+# confirmado, borrar de las calientes.
+#
+# export_season() / import_season() vuelcan una temporada entera (calientes y
+# frías) como JSON Lines comprimido, por lotes y sin cargarla en memoria:
+#
+#   python archive.py archive --db game.db --keep 3
+#   python archive.py export  --db game.db temporada.jsonl.gz
+#   python archive.py import  --db nueva.db temporada.jsonl.gz   (y archiva con --keep)
+# =============================================================================
+import argparse
+import base64
+import datetime as dt
+import gzip
+import json
+import os
+import re
+
+from db import Pool, migrate, schema_version, transaction
+
+BATCH = 1000
+ROUND_TABLES = ["frases", "ballots", "screens", "judge_screens", "player_round", "purchases"]
+COLD_TABLES = ROUND_TABLES + ["coin_ledger"]
+SEASON_TABLES = ["settings", "users", "rounds", "frases", "ballots", "screens", "judge_screens",
+                 "player_round", "purchases", "round_results", "player_stats", "coin_ledger", "coin_balances"]
+FORMAT = "twowte-season"
+
+# movimientos que ya cuenta la foto de saldo de su usuario
+_SNAPSHOTTED = ("id <= COALESCE((SELECT ledger_id FROM main.coin_balances b "
+                "WHERE b.username = coin_ledger.username), 0)")
+
+
+def archive_path(path):
+    return os.path.splitext(path)[0] + ".archive.db"
+
+
+def _attached(conn):
+    return {row[1] for row in conn.execute("PRAGMA database_list")}
+
+
+def attach(conn, create=True):
+    """Adjunta el archivo de la base de conn como cold; False si no existe y no se crea."""
+    if "cold" in _attached(conn):
+        return True
+    path = archive_path(conn.shard)
+    if not create and not os.path.exists(path):
+        return False
+    conn.execute("ATTACH DATABASE ? AS cold", (path,))
+    conn.execute("PRAGMA cold.journal_mode=WAL")
+    return True
+
+
+def _columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _sync_table(conn, table):
+    """Crea la tabla en cold con la definición de main, o le añade columnas nuevas."""
+    cold = _columns(conn, "cold", table)
+    if not cold:
+        sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()[0]
+        conn.execute(re.sub(r'^CREATE TABLE (IF NOT EXISTS )?("?)\w+\2', f"CREATE TABLE cold.{table}", sql))
+        key = "username, id" if table == "coin_ledger" else "round_id"
+        conn.execute(f"CREATE INDEX cold.idx_{table}_archive ON {table}({key})")
+        return
+    for _, name, ctype, *_ in conn.execute(f"PRAGMA main.table_info({table})"):
+        if name not in cold:
+            conn.execute(f"ALTER TABLE cold.{table} ADD COLUMN {name} {ctype}")
+
+
+def archive_rounds(conn, keep):
+    """Pasa a cold las rondas cerradas salvo las `keep` más recientes; devuelve cuántas."""
+    ids = [rid for (rid,) in conn.execute(
+        "SELECT id FROM rounds WHERE status='closed' AND archived_at IS NULL "
+        "AND id NOT IN (SELECT id FROM rounds WHERE status='closed' ORDER BY id DESC LIMIT ?) "
+        "ORDER BY id", (keep,))]
+    attach(conn)
+    rounds = json.dumps(ids)
+    in_rounds = "round_id IN (SELECT value FROM json_each(?))"
+    # 1) copiar: sólo escribe en cold y repetirlo no duplica (claves primarias)
+    with transaction(conn):
+        for table in COLD_TABLES:
+            _sync_table(conn, table)
+            cols = ", ".join(_columns(conn, "main", table))
+            if table == "coin_ledger":
+                conn.execute(f"INSERT OR IGNORE INTO cold.coin_ledger({cols}) "
+                             f"SELECT {cols} FROM main.coin_ledger WHERE {_SNAPSHOTTED}")
+            elif ids:
+                conn.execute(f"INSERT OR IGNORE INTO cold.{table}({cols}) "
+                             f"SELECT {cols} FROM main.{table} WHERE {in_rounds}", (rounds,))
+    # 2) borrar de las calientes lo que ya está confirmado en cold
+    with transaction(conn):
+        conn.execute(f"DELETE FROM main.coin_ledger WHERE {_SNAPSHOTTED} "
+                     "AND id IN (SELECT id FROM cold.coin_ledger)")
+        if ids:
+            for table in ROUND_TABLES:
+                conn.execute(f"DELETE FROM main.{table} WHERE {in_rounds}", (rounds,))
+            conn.execute("UPDATE rounds SET archived_at=? WHERE id IN (SELECT value FROM json_each(?))",
+                         (dt.datetime.utcnow().isoformat(), rounds))
+    return len(ids)
+
+
+def after_close(conn):
+    """Archiva según el ajuste archive_keep; tras cada cierre (worker o admin)."""
+    keep = int(conn.execute("SELECT valor FROM settings WHERE clave='archive_keep'").fetchone()[0])
+    return archive_rounds(conn, keep)
+
+
+def purge(conn):
+    """Vacía el archivo (reinicio total de la base)."""
+    if not attach(conn, create=False):
+        return
+    with transaction(conn):
+        for table in COLD_TABLES:
+            if _columns(conn, "cold", table):
+                conn.execute(f"DELETE FROM cold.{table}")
+
+
+def counts(conn):
+    """{tabla: (filas calientes, filas archivadas)} para el panel Admin."""
+    cold = attach(conn, create=False)
+    out = {}
+    for table in COLD_TABLES:
+        hot = conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0]
+        archived = (conn.execute(f"SELECT COUNT(*) FROM cold.{table}").fetchone()[0]
+                    if cold and _columns(conn, "cold", table) else 0)
+        out[table] = (hot, archived)
+    return out
+
+
+# ---------- Exportación / importación por lotes ------------------------------
+def _encode(value):
+    return {"$b64": base64.b64encode(value).decode()} if isinstance(value, bytes) else value
+
+
+def _decode(value):
+    return base64.b64decode(value["$b64"]) if isinstance(value, dict) else value
+
+
+def iter_batches(conn, batch=BATCH):
+    """(tabla, columnas, filas) de toda la temporada, calientes y frías, por lotes."""
+    cold = attach(conn, create=False)
+    for table in SEASON_TABLES:
+        cols = _columns(conn, "main", table)
+        sql = f"SELECT {', '.join(cols)} FROM main.{table}"
+        cold_cols = _columns(conn, "cold", table) if cold and table in COLD_TABLES else []
+        if cold_cols:
+            # columnas añadidas después de archivar: NULL en las filas frías
+            sql += " UNION ALL SELECT " + ", ".join(c if c in cold_cols else f"NULL AS {c}" for c in cols)
+            sql += f" FROM cold.{table}"
+        cur = conn.execute(sql)
+        while rows := cur.fetchmany(batch):
+            yield table, cols, rows
+
+
+def export_season(conn, path, batch=BATCH):
+    """Escribe la temporada en path (JSON Lines gzip); devuelve filas escritas."""
+    total = 0
+    attach(conn, create=False)  # fuera de la transacción de lectura
+    conn.execute("BEGIN")       # una sola foto de todas las tablas
+    try:
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            f.write(json.dumps({"format": FORMAT, "schema": schema_version(conn), "tables": SEASON_TABLES}) + "\n")
+            for table, cols, rows in iter_batches(conn, batch):
+                f.write(json.dumps({"table": table, "columns": cols,
+                                    "rows": [[_encode(v) for v in row] for row in rows]},
+                                   ensure_ascii=False) + "\n")
+                total += len(rows)
+    finally:
+        conn.rollback()
+    return total
+
+
+def import_season(conn, path):
+    """Carga una exportación en una base recién migrada y vacía; devuelve filas."""
+    total = 0
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("format") != FORMAT:
+            raise ValueError("No es una exportación de temporada TWOWTE")
+        if header["schema"] != schema_version(conn):
+            raise ValueError(f"Exportada con esquema {header['schema']}; esta base está en {schema_version(conn)}")
+        with transaction(conn):
+            for line in f:
+                chunk = json.loads(line)
+                cols = chunk["columns"]
+                # los nombres van al SQL tal cual: sólo tablas y columnas conocidas
+                if chunk["table"] not in SEASON_TABLES:
+                    raise ValueError(f"Tabla desconocida en la exportación: {chunk['table']!r}")
+                unknown = set(cols) - set(_columns(conn, "main", chunk["table"]))
+                if unknown or not cols:
+                    raise ValueError(f"Columnas desconocidas en {chunk['table']}: {sorted(unknown)}")
+                conn.executemany(
+                    f"INSERT INTO {chunk['table']}({', '.join(cols)}) VALUES({', '.join('?' * len(cols))})",
+                    ([_decode(v) for v in row] for row in chunk["rows"]))
+                total += len(chunk["rows"])
+            # todo entra en las tablas calientes: las rondas vuelven a ser archivables
+            conn.execute("UPDATE rounds SET archived_at=NULL")
+    return total
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Archivo frío y exportación de temporadas TWOWTE")
+    ap.add_argument("command", choices=["archive", "export", "import"])
+    ap.add_argument("file", nargs="?", help="fichero .jsonl.gz para export/import")
+    ap.add_argument("--db", default="game.db")
+    ap.add_argument("--keep", type=int, default=3, help="rondas cerradas que se quedan calientes")
+    args = ap.parse_intermixed_args(argv)
+    if args.command != "archive" and not args.file:
+        ap.error("export/import necesitan un fichero")
+    if args.command == "import" and os.path.exists(args.db):
+        ap.error("import sólo carga en una base nueva")
+
+    conn = Pool(args.db).writer()
+    migrate(conn)
+    if args.command == "archive":
+        print(f"{archive_rounds(conn, args.keep)} rondas archivadas")
+    elif args.command == "export":
+        print(f"{export_season(conn, args.file)} filas exportadas a {args.file}")
+    else:
+        print(f"{import_season(conn, args.file)} filas importadas en {args.db}")
+        print(f"{archive_rounds(conn, args.keep)} rondas archivadas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# TWOWTE – Contraseñas con hash y tokens de sesión
+# =============================================================================
+# users.password guarda "scrypt$n$r$p$sal$hash" (o "pbkdf2_sha256$iter$sal$hash"
+# si hashlib no trae scrypt). Las filas antiguas en claro siguen valiendo y se
+# convierten a hash en su siguiente login correcto.
+#
+# El hash es lento a propósito, así que sólo se calcula en un login de verdad:
+# login() emite un token firmado (HMAC-SHA256) que la sesión guarda, y cada
+# rerun lo valida con check(): firma + caché en memoria con TTL, sin leer
+# users. revoke() invalida los tokens de una liga (o de algunos usuarios) al
+# desactivar cuentas o reiniciar la base. La caché es del proceso: reiniciar
+# el servidor obliga a volver a entrar.
+# =============================================================================
+import base64
+import concurrent.futures
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+from db import transaction
+
+SCRYPT = (2 ** 14, 8, 1)      # n, r, p
+PBKDF2_ITERATIONS = 600_000
+HASH_WORKERS = min(4, os.cpu_count() or 1)   # cada scrypt reserva ~16 MiB
+SESSION_TTL = int(os.environ.get("TWOWTE_SESSION_TTL", str(12 * 3600)))  # segundos
+
+# sin TWOWTE_SECRET cada proceso firma con una clave nueva
+_SECRET = os.environ.get("TWOWTE_SECRET", "").encode() or os.urandom(32)
+_lock = threading.Lock()
+_sessions = {}                # token -> (liga, usuario, is_admin, caduca)
+
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+# ---------- Hashes -----------------------------------------------------------
+def hash_password(password):
+    salt = os.urandom(16)
+    if hasattr(hashlib, "scrypt"):
+        n, r, p = SCRYPT
+        digest = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=32)
+        return f"scrypt${n}${r}${p}${_b64(salt)}${_b64(digest)}"
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, PBKDF2_ITERATIONS)
+    return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${_b64(salt)}${_b64(digest)}"
+
+
+def hash_many(passwords):
+    """hash_password en paralelo (hashlib suelta el GIL): altas masivas."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=HASH_WORKERS) as ex:
+        return list(ex.map(hash_password, passwords))
+
+
+def is_hashed(stored):
+    return stored.startswith(("scrypt$", "pbkdf2_sha256$"))
+
+
+def verify_password(stored, password):
+    """True si password corresponde a stored (hash o texto en claro antiguo)."""
+    parts = stored.split("$")
+    if parts[0] == "scrypt" and len(parts) == 6:
+        n, r, p = map(int, parts[1:4])
+        digest = hashlib.scrypt(password.encode(), salt=_unb64(parts[4]), n=n, r=r, p=p, dklen=32)
+    elif parts[0] == "pbkdf2_sha256" and len(parts) == 4:
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), _unb64(parts[2]), int(parts[1]))
+    else:
+        return hmac.compare_digest(stored.encode(), password.encode())
+    return hmac.compare_digest(digest, _unb64(parts[-1]))
+
+
+# ---------- Login y tokens ---------------------------------------------------
+def login(conn, league_id, username, password):
+    """Comprueba credenciales contra la base; devuelve (token, is_admin) o None."""
+    row = conn.execute("SELECT password, is_admin, active FROM users WHERE username=?", (username,)).fetchone()
+    if not row or row[2] != 1 or not verify_password(row[0], password):
+        return None
+    if not is_hashed(row[0]):
+        # fila en claro: se convierte ahora que sabemos la contraseña
+        with transaction(conn):
+            conn.execute("UPDATE users SET password=? WHERE username=? AND password=?",
+                         (hash_password(password), username, row[0]))
+    return issue(league_id, username, bool(row[1])), bool(row[1])
+
+
+def issue(league_id, username, is_admin):
+    """Token firmado para la sesión; queda en la caché hasta caducar."""
+    expires = int(time.time()) + SESSION_TTL
+    payload = _b64(json.dumps([league_id, username, is_admin, expires, _b64(os.urandom(9))]).encode())
+    token = f"{payload}.{_b64(hmac.new(_SECRET, payload.encode(), hashlib.sha256).digest())}"
+    with _lock:
+        now = time.time()
+        for t in [t for t, s in _sessions.items() if s[3] <= now]:
+            del _sessions[t]
+        _sessions[token] = (league_id, username, is_admin, expires)
+    return token
+
+
+def check(token, league_id):
+    """(usuario, is_admin) si el token es válido para la liga; None si no."""
+    if not token or "." not in token:
+        return None
+    payload, sig = token.rsplit(".", 1)
+    expected = _b64(hmac.new(_SECRET, payload.encode(), hashlib.sha256).digest())
+    if not hmac.compare_digest(sig, expected):
+        return None
+    with _lock:
+        session = _sessions.get(token)
+    if not session or session[0] != league_id or session[3] <= time.time():
+        return None
+    return session[1], session[2]
+
+
+def revoke(league_id, usernames=None):
+    """Invalida los tokens de la liga (sólo los de usernames, si se da)."""
+    usernames = None if usernames is None else set(usernames)
+    with _lock:
+        for t in [t for t, s in _sessions.items()
+                  if s[0] == league_id and (usernames is None or s[1] in usernames)]:
+            del _sessions[t]
@@ -0,0 +1,200 @@
+# TWOWTE – Micro-benchmarks del motor
+# =============================================================================
+# Genera una temporada sintética contra un SQLite temporal usando las mismas
+# funciones de engine.py que la app y mide los caminos calientes: envío de
+# frases, envío de papeletas, cierre de ronda y agregación del historial.
+# También compara el almacenamiento de papeletas con el antiguo votos (una
+# fila por frase) y mide escrituras concurrentes con muchas sesiones.
+#
+#   python bench.py --players 1000 --judges 30 --rounds 40 --out bench.json
+# =============================================================================
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import engine
+from db import Pool
+
+
+def _summary(samples):
+    ms = np.asarray(samples) * 1000
+    return {
+        "n": len(ms),
+        "total_s": round(float(ms.sum()) / 1000, 4),
+        "mean_ms": round(float(ms.mean()), 4),
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "max_ms": round(float(ms.max()), 4),
+    }
+
+
+def _timed(samples, fn, *args):
+    t = time.perf_counter()
+    out = fn(*args)
+    samples.append(time.perf_counter() - t)
+    return out
+
+
+def seed_users(conn, players, judges):
+    conn.executemany("INSERT INTO users VALUES(?,?,?,?,?)",
+                     [(f"p{i:05d}", "x", "jugador", 0, 1) for i in range(players)]
+                     + [(f"j{i:03d}", "x", "juez", 0, 1) for i in range(judges)])
+    # la ronda abierta del arranque se creó sin usuarios
+    conn.execute("INSERT OR IGNORE INTO player_round(round_id, username, responses_left) "
+                 "SELECT r.id, u.username, 1 FROM rounds r, users u WHERE r.status='open' AND u.active=1")
+    conn.commit()
+
+
+def run_season(conn, rounds, rng):
+    """Temporada completa; devuelve los tiempos por operación."""
+    t = {"phrase_submit": [], "ballot_submit": [], "round_close": []}
+    judges = [r[0] for r in conn.execute("SELECT username FROM users WHERE role='juez' AND active=1")]
+    for _ in range(rounds):
+        rid = conn.execute("SELECT id FROM rounds WHERE status='open'").fetchone()[0]
+        players = [r[0] for r in conn.execute("SELECT username FROM users WHERE role='jugador' AND active=1")]
+        if len(players) < 2:
+            break
+        for p in players:
+            _timed(t["phrase_submit"], engine.submit_phrase, conn, rid, p, f"frase {rid} de {p}")
+        fids = [r[0] for r in conn.execute("SELECT id FROM frases WHERE round_id=?", (rid,))]
+        for j in judges:
+            rng.shuffle(fids)
+            _timed(t["ballot_submit"], engine.submit_ballot, conn, rid, j, fids)
+        _timed(t["round_close"], engine.close_round, conn, rid)
+    return t
+
+
+def bench_history(conn, repeat):
+    samples = []
+    for _ in range(repeat):
+        _timed(samples, engine.history, conn)
+    return samples
+
+
+def bench_ballot_storage(workdir, phrases, judges, rng):
+    """Una ronda de papeletas: votos (fila por frase) frente a ballots (BLOB)."""
+    from scoring import pack_ranking
+
+    def fresh(name):
+        conn = sqlite3.connect(os.path.join(workdir, name))
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    legacy = fresh("legacy.db")
+    legacy.execute("CREATE TABLE votos(id INTEGER PRIMARY KEY AUTOINCREMENT, juez TEXT NOT NULL, "
+                   "frase_id INTEGER NOT NULL, posicion INTEGER NOT NULL, round_id INTEGER)")
+    legacy.execute("CREATE INDEX idx_votos_frase ON votos(frase_id)")
+    legacy.execute("CREATE INDEX idx_votos_round_juez ON votos(round_id, juez)")
+    packed = fresh("packed.db")
+    packed.execute("CREATE TABLE ballots(round_id INTEGER NOT NULL, juez TEXT NOT NULL, ranking BLOB NOT NULL, "
+                   "PRIMARY KEY(round_id, juez)) WITHOUT ROWID")
+
+    def submit_legacy(juez, ids):
+        legacy.execute("DELETE FROM votos WHERE juez=? AND round_id=1", (juez,))
+        for pos, fid in enumerate(ids, 1):
+            legacy.execute("INSERT INTO votos(juez, frase_id, posicion, round_id) VALUES(?,?,?,1)", (juez, fid, pos))
+        legacy.commit()
+
+    def submit_packed(juez, ids):
+        packed.execute("REPLACE INTO ballots VALUES(1,?,?)", (juez, pack_ranking(ids)))
+        packed.commit()
+
+    ids = list(range(1, phrases + 1))
+    t_legacy, t_packed = [], []
+    for j in range(judges):
+        rng.shuffle(ids)
+        _timed(t_legacy, submit_legacy, f"j{j}", ids)
+        _timed(t_packed, submit_packed, f"j{j}", ids)
+    sizes = {}
+    for name, conn in (("legacy", legacy), ("packed", packed)):
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+        sizes[name] = os.path.getsize(os.path.join(workdir, f"{name}.db"))
+        conn.close()
+    return {
+        "phrases": phrases, "judges": judges,
+        "legacy_bytes": sizes["legacy"], "packed_bytes": sizes["packed"],
+        "legacy_submit": _summary(t_legacy), "packed_submit": _summary(t_packed),
+    }
+
+
+def bench_concurrency(path, sessions, ops):
+    """`sessions` hilos con conexiones del pool: escritura + lectura por op."""
+    pool = Pool(path)
+    errors, latencies, lock = [], [], threading.Lock()
+    rid = pool.writer().execute("SELECT id FROM rounds WHERE status='open'").fetchone()[0]
+
+    def session(i):
+        w, r, local = pool.writer(), pool.reader(), []
+        for k in range(ops):
+            try:
+                t = time.perf_counter()
+                w.execute("INSERT INTO frases(texto, autor, round_id) VALUES(?,?,?)", (f"c{i}-{k}", f"s{i}", rid))
+                w.commit()
+                r.execute("SELECT COUNT(DISTINCT autor) FROM frases WHERE round_id=?", (rid,)).fetchone()
+                local.append(time.perf_counter() - t)
+            except sqlite3.Error as e:
+                with lock:
+                    errors.append(str(e))
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+    t = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    elapsed = time.perf_counter() - t
+    return {
+        "sessions": sessions, "ops": len(latencies), "errors": len(errors),
+        "throughput_ops_s": round(len(latencies) / elapsed, 1), "latency": _summary(latencies),
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Micro-benchmarks del motor TWOWTE")
+    ap.add_argument("--players", type=int, default=1000)
+    ap.add_argument("--judges", type=int, default=30)
+    ap.add_argument("--rounds", type=int, default=40)
+    ap.add_argument("--sessions", type=int, default=50)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="fichero JSON (por defecto, stdout)")
+    args = ap.parse_args(argv)
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "bench.db")
+        conn = Pool(path).writer()  # el préstamo mantiene vivo el pool
+        engine.bootstrap(conn)
+        seed_users(conn, args.players, args.judges)
+        t = time.perf_counter()
+        season = run_season(conn, args.rounds, rng)
+        report = {
+            "params": vars(args),
+            "season_s": round(time.perf_counter() - t, 3),
+            **{k: _summary(v) for k, v in season.items() if v},
+            "history": _summary(bench_history(conn, 50)),
+            "ballot_storage": bench_ballot_storage(workdir, min(args.players, 300), args.judges, rng),
+            "concurrency": bench_concurrency(path, args.sessions, 50),
+            "db_bytes": os.path.getsize(path),
+        }
+
+    out = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
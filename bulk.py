@@ -0,0 +1,140 @@
+# TWOWTE – Operaciones masivas del panel Admin (CSV)
+# =============================================================================
+# Alta de usuarios, ajustes de monedas/penalización/respuestas y bajas a partir
+# de un CSV (coma o punto y coma, con cabecera). Cada parse_* valida el fichero
+# entero en memoria contra la base y devuelve (filas, errores); con un solo
+# error no se aplica nada. Cada apply_* escribe todas las filas con executemany
+# en una única transacción y sube la revisión de la ronda abierta.
+#
+#   usuarios:  username, password, role          (role: jugador | juez)
+#   ajustes:   username, monedas, penalizacion, respuestas   (vacío = 0)
+#   bajas:     username
+# =============================================================================
+import csv
+import io
+
+import auth
+import ledger
+from db import transaction
+from engine import touch_round
+
+ROLES = ("jugador", "juez")
+ADJUST_FIELDS = ("monedas", "penalizacion", "respuestas")
+
+
+def _decode(data):
+    """UTF-8 (con o sin BOM) y, si no lo es, cp1252: lo que exporta Excel en español."""
+    for encoding in ("utf-8-sig", "cp1252"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    return data.decode("latin-1")  # nunca falla
+
+
+def _read(data, required):
+    """Filas [(línea, {columna: valor})] del CSV, o errores de cabecera."""
+    text = _decode(data) if isinstance(data, bytes) else data
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+    reader.fieldnames = [f.strip().lower() for f in reader.fieldnames or []]
+    missing = [f for f in required if f not in reader.fieldnames]
+    if missing:
+        return [], [f"Faltan columnas: {', '.join(missing)}"]
+    return [(line, {k: (v or "").strip() for k, v in row.items() if k})
+            for line, row in enumerate(reader, 2)], []
+
+
+def _usernames(conn):
+    return {u for (u,) in conn.execute("SELECT username FROM users")}
+
+
+def parse_users(conn, data):
+    """Altas [(usuario, contraseña, rol)]."""
+    rows, errors = _read(data, ("username", "password", "role"))
+    existing, seen, out = _usernames(conn), set(), []
+    for line, row in rows:
+        u, p, role = row["username"], row["password"], row["role"].lower()
+        if not u or not p:
+            errors.append(f"Línea {line}: usuario y contraseña obligatorios")
+        elif role not in ROLES:
+            errors.append(f"Línea {line}: rol {row['role']!r} no válido (jugador o juez)")
+        elif u in existing:
+            errors.append(f"Línea {line}: {u} ya existe")
+        elif u in seen:
+            errors.append(f"Línea {line}: {u} repetido en el fichero")
+        else:
+            seen.add(u)
+            out.append((u, p, role))
+    return out, errors
+
+
+def apply_users(conn, rows, round_id):
+    """Crea los usuarios y los añade a la ronda abierta; devuelve cuántos."""
+    # el hash (lento) antes de tomar el bloqueo de escritura
+    hashes = auth.hash_many([p for _, p, _ in rows])
+    with transaction(conn):
+        conn.executemany("INSERT INTO users VALUES(?,?,?,0,1)",
+                         [(u, h, role) for (u, _, role), h in zip(rows, hashes)])
+        conn.executemany("INSERT OR IGNORE INTO player_round(round_id, username, responses_left) VALUES(?,?,1)",
+                         [(round_id, u) for u, _, _ in rows])
+        touch_round(conn, round_id)
+    return len(rows)
+
+
+def parse_adjustments(conn, data, round_id):
+    """Ajustes [(usuario, monedas, penalización, respuestas)]."""
+    rows, errors = _read(data, ("username",))
+    existing = _usernames(conn)
+    in_round = {u for (u,) in conn.execute("SELECT username FROM player_round WHERE round_id=?", (round_id,))}
+    out = []
+    for line, row in rows:
+        u = row["username"]
+        try:
+            coins, pen, resp = (int(row.get(f) or 0) for f in ADJUST_FIELDS)
+        except ValueError:
+            errors.append(f"Línea {line}: monedas, penalizacion y respuestas deben ser enteros")
+            continue
+        if u not in existing:
+            errors.append(f"Línea {line}: {u or '(vacío)'} no existe")
+        elif (pen or resp) and u not in in_round:
+            errors.append(f"Línea {line}: {u} no juega la ronda actual")
+        elif coins or pen or resp:
+            out.append((u, coins, pen, resp))
+    return out, errors
+
+
+def apply_adjustments(conn, rows, round_id):
+    """Aplica los ajustes en la ronda abierta; devuelve cuántas filas."""
+    with transaction(conn):
+        ledger.append(conn, [(u, coins, "ajuste admin") for u, coins, _, _ in rows], round_id)
+        conn.executemany(
+            "UPDATE player_round SET penalty = penalty + ?, responses_left = responses_left + ? "
+            "WHERE round_id=? AND username=?",
+            [(pen, resp, round_id, u) for u, _, pen, resp in rows if pen or resp])
+        touch_round(conn, round_id)
+    return len(rows)
+
+
+def parse_deactivations(conn, data):
+    """Bajas [usuario], sin repetidos."""
+    rows, errors = _read(data, ("username",))
+    existing, out = _usernames(conn), []
+    for line, row in rows:
+        u = row["username"]
+        if u not in existing:
+            errors.append(f"Línea {line}: {u or '(vacío)'} no existe")
+        elif u not in out:
+            out.append(u)
+    return out, errors
+
+
+def apply_deactivations(conn, rows, round_id):
+    """Desactiva los usuarios; devuelve cuántos."""
+    with transaction(conn):
+        conn.executemany("UPDATE users SET active=0 WHERE username=?", [(u,) for u in rows])
+        touch_round(conn, round_id)
+    return len(rows)
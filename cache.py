@@ -0,0 +1,77 @@
+# TWOWTE – Caché de proceso para ajustes, usuarios, ronda abierta y resultados
+# =============================================================================
+# Compartida por todas las sesiones del servidor y separada por base (liga):
+# las conexiones del pool saben de qué fichero son (conn.shard). Cada
+# escritura que toca estos datos llama a bump(conn): la versión de esa base
+# sube y la siguiente lectura recarga desde SQLite. Las decisiones sensibles
+# (login, pago de premios) no leen de aquí sino directamente de la base.
+# =============================================================================
+import threading
+
+_lock = threading.Lock()
+_epoch = 0     # bump() sin conexión invalida todas las bases
+_versions = {}  # base -> versión
+_store = {}    # (base, nombre) -> (versión, valor)
+
+
+def _shard(conn):
+    return getattr(conn, "shard", None)
+
+
+def bump(conn=None):
+    """Invalida lo cacheado de la base de conn (o todo); llamar tras el commit."""
+    global _epoch
+    with _lock:
+        if conn is None:
+            _epoch += 1
+            _store.clear()
+            return
+        shard = _shard(conn)
+        _versions[shard] = _versions.get(shard, 0) + 1
+        for key in [k for k in _store if k[0] == shard]:
+            del _store[key]
+
+
+def _cached(conn, name, loader):
+    key = (_shard(conn), name)
+    with _lock:
+        version = (_epoch, _versions.get(key[0], 0))
+        hit = _store.get(key)
+    if hit and hit[0] == version:
+        return hit[1]
+    # la versión se toma antes de leer: si otra escritura entra mientras
+    # cargamos, el valor queda marcado como viejo y se recargará
+    value = loader()
+    with _lock:
+        if version == (_epoch, _versions.get(key[0], 0)):
+            _store[key] = (version, value)
+    return value
+
+
+def settings(conn):
+    return _cached(conn, "settings", lambda: dict(conn.execute("SELECT clave, valor FROM settings").fetchall()))
+
+
+def users(conn):
+    return _cached(conn, "users", lambda: {u[0]: u for u in conn.execute(
+        "SELECT username,password,role,is_admin,active FROM users").fetchall()})
+
+
+def open_round(conn):
+    """(id, número) de la ronda abierta, o None."""
+    return _cached(conn, "open_round", lambda: conn.execute(
+        "SELECT id, numero FROM rounds WHERE status='open' ORDER BY numero DESC LIMIT 1").fetchone())
+
+
+def last_results(conn):
+    """(número, filas de round_results) de la última ronda cerrada, o None."""
+    def load():
+        last = conn.execute("SELECT id, numero FROM rounds WHERE status='closed' ORDER BY numero DESC LIMIT 1").fetchone()
+        return last and (last[1], conn.execute(
+            "SELECT autor, puntos, df, std, texto FROM round_results WHERE round_id=? ORDER BY pos", (last[0],)).fetchall())
+    return _cached(conn, "last_results", load)
+
+
+def derived(conn, name, loader):
+    """loader() calculado fuera de este módulo (Historial), con la misma invalidación."""
+    return _cached(conn, name, loader)
@@ -0,0 +1,386 @@
+# TWOWTE – Esquema, migraciones y conexiones
+# =============================================================================
+# El esquema se versiona con PRAGMA user_version: cada migración se aplica una
+# sola vez, en orden y en su propia transacción. Para cambiar el esquema se
+# añade una función nueva al final de MIGRATIONS; nunca se edita una existente.
+# =============================================================================
+import contextlib
+import queue
+import sqlite3
+import threading
+import time
+import weakref
+
+import ledger
+from scoring import pack_ranking
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _m001_base(conn):
+    """Esquema original (idempotente para bases creadas antes de versionar)."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users(
+      username TEXT PRIMARY KEY,
+      password TEXT NOT NULL,
+      role TEXT NOT NULL,            -- 'jugador' | 'juez'
+      is_admin INTEGER NOT NULL,
+      coins INTEGER NOT NULL DEFAULT 0,
+      active INTEGER NOT NULL DEFAULT 1)
+    """)
+
+    conn.execute("CREATE TABLE IF NOT EXISTS settings(clave TEXT PRIMARY KEY, valor TEXT)")
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS rounds(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      numero INTEGER NOT NULL,
+      status TEXT NOT NULL,
+      created_at TEXT NOT NULL)
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS frases(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      texto TEXT NOT NULL,
+      autor TEXT NOT NULL,
+      round_id INTEGER NOT NULL)
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS votos(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      juez TEXT NOT NULL,
+      frase_id INTEGER NOT NULL,
+      posicion INTEGER NOT NULL)
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS player_round(
+      round_id INTEGER NOT NULL,
+      username TEXT NOT NULL,
+      responses_left INTEGER NOT NULL,
+      df_flag INTEGER NOT NULL DEFAULT 0,
+      multiplier INTEGER NOT NULL DEFAULT 1,
+      penalty INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY(round_id,username))
+    """)
+    # bases de versiones previas sin la columna penalty
+    if "penalty" not in _columns(conn, "player_round"):
+        conn.execute("ALTER TABLE player_round ADD COLUMN penalty INTEGER NOT NULL DEFAULT 0")
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS purchases(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      round_id INTEGER NOT NULL,
+      username TEXT NOT NULL,
+      item TEXT NOT NULL,
+      meta TEXT)
+    """)
+
+    # resultados materializados al cerrar cada ronda y agregados por jugador
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS round_results(
+      round_id INTEGER NOT NULL,
+      pos INTEGER NOT NULL,          -- puesto de la frase (1 = mejor)
+      frase_id INTEGER NOT NULL,
+      autor TEXT NOT NULL,
+      texto TEXT NOT NULL,
+      puntos INTEGER NOT NULL,
+      df INTEGER NOT NULL,
+      std REAL NOT NULL,
+      reward INTEGER,                -- NULL en rondas cerradas antes de existir la tabla
+      PRIMARY KEY(round_id, pos))
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS player_stats(
+      username TEXT PRIMARY KEY,
+      rondas INTEGER NOT NULL DEFAULT 0,
+      victorias INTEGER NOT NULL DEFAULT 0,
+      suma_puestos INTEGER NOT NULL DEFAULT 0)
+    """)
+
+
+def _m002_indexes(conn):
+    """Índices para las consultas calientes de cada rerun."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_frases_round ON frases(round_id, autor)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_votos_frase ON votos(frase_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_votos_juez ON votos(juez)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_purchases_round_user ON purchases(round_id, username)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rounds_status ON rounds(status, numero)")
+
+
+def _m003_votos_round(conn):
+    """votos.round_id desnormalizado para evitar el IN (SELECT id FROM frases ...)."""
+    conn.execute("ALTER TABLE votos ADD COLUMN round_id INTEGER")
+    conn.execute("UPDATE votos SET round_id = (SELECT round_id FROM frases WHERE frases.id = votos.frase_id)")
+    conn.execute("CREATE INDEX idx_votos_round_juez ON votos(round_id, juez)")
+
+
+def _m004_rounds_deadline(conn):
+    """Fecha límite opcional (ISO UTC) para el cierre automático de la ronda."""
+    conn.execute("ALTER TABLE rounds ADD COLUMN deadline TEXT")
+
+
+def _m005_ballots(conn):
+    """Una papeleta empaquetada por (ronda, juez) en lugar de una fila por frase."""
+    conn.execute("""
+    CREATE TABLE ballots(
+      round_id INTEGER NOT NULL,
+      juez TEXT NOT NULL,
+      ranking BLOB NOT NULL,         -- ids de frase int32 LE, de mejor a peor
+      PRIMARY KEY(round_id, juez)) WITHOUT ROWID
+    """)
+    rows = conn.execute("SELECT round_id, juez, frase_id FROM votos "
+                        "WHERE round_id IS NOT NULL ORDER BY round_id, juez, posicion")
+    ballots, key, ids = [], None, []
+    for rid, juez, fid in rows:
+        if (rid, juez) != key:
+            if ids:
+                ballots.append((*key, pack_ranking(ids)))
+            key, ids = (rid, juez), []
+        ids.append(fid)
+    if ids:
+        ballots.append((*key, pack_ranking(ids)))
+    conn.executemany("INSERT INTO ballots VALUES(?,?,?)", ballots)
+    conn.execute("DROP TABLE votos")
+
+
+def _m006_screens(conn):
+    """Pantallas de votación (modo screens) y a qué pantalla va cada juez."""
+    conn.execute("""
+    CREATE TABLE screens(
+      round_id INTEGER NOT NULL,
+      screen INTEGER NOT NULL,
+      pos INTEGER NOT NULL,
+      frase_id INTEGER NOT NULL,
+      PRIMARY KEY(round_id, screen, pos)) WITHOUT ROWID
+    """)
+    conn.execute("""
+    CREATE TABLE judge_screens(
+      round_id INTEGER NOT NULL,
+      juez TEXT NOT NULL,
+      screen INTEGER NOT NULL,
+      PRIMARY KEY(round_id, juez)) WITHOUT ROWID
+    """)
+
+
+def _m007_coin_ledger(conn):
+    """Libro mayor de monedas con fotos de saldo; users.coins pasa a la apertura."""
+    conn.execute("""
+    CREATE TABLE coin_ledger(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      username TEXT NOT NULL,
+      delta INTEGER NOT NULL,
+      reason TEXT NOT NULL,          -- 'premio', 'compra: …', 'ruleta', 'ajuste admin', …
+      round_id INTEGER,
+      created_at TEXT NOT NULL)
+    """)
+    conn.execute("CREATE INDEX idx_ledger_user ON coin_ledger(username, id)")
+    conn.execute("""
+    CREATE TABLE coin_balances(
+      username TEXT PRIMARY KEY,
+      balance INTEGER NOT NULL,
+      ledger_id INTEGER NOT NULL)    -- la foto incluye las entradas hasta este id
+    """)
+    ledger.append(conn, conn.execute("SELECT username, coins, 'apertura' FROM users").fetchall())
+    ledger.snapshot(conn)
+    conn.execute("ALTER TABLE users DROP COLUMN coins")
+
+
+def _m008_round_rev(conn):
+    """Revisión por ronda: sube con cada escritura que cambia lo que se ve en vivo."""
+    conn.execute("ALTER TABLE rounds ADD COLUMN rev INTEGER NOT NULL DEFAULT 0")
+
+
+def _m009_player_rating(conn):
+    """Rating Elo por jugador y cuántas rondas incluye (bootstrap lo recalcula)."""
+    conn.execute("ALTER TABLE player_stats ADD COLUMN rating REAL NOT NULL DEFAULT 1500")
+    conn.execute("ALTER TABLE player_stats ADD COLUMN rated INTEGER NOT NULL DEFAULT 0")
+
+
+def _m010_rounds_archived(conn):
+    """Marca de las rondas cuyas tablas calientes ya están en el archivo (archive.py)."""
+    conn.execute("ALTER TABLE rounds ADD COLUMN archived_at TEXT")
+
+
+def _m011_phrase_search(conn):
+    """Índice FTS5 de las frases ya puntuadas (round_results) e índices del listado."""
+    conn.execute("CREATE UNIQUE INDEX idx_round_results_frase ON round_results(frase_id)")
+    conn.execute("CREATE INDEX idx_round_results_browse ON round_results(round_id DESC, pos)")
+    conn.execute("CREATE INDEX idx_round_results_autor ON round_results(autor, round_id DESC, pos)")
+    conn.execute("""
+    CREATE VIRTUAL TABLE phrase_search USING fts5(
+      texto, content='round_results', content_rowid='frase_id',
+      tokenize='unicode61 remove_diacritics 2')
+    """)
+    # contenido externo: los triggers mantienen el índice al día
+    conn.execute("""
+    CREATE TRIGGER round_results_ai AFTER INSERT ON round_results BEGIN
+      INSERT INTO phrase_search(rowid, texto) VALUES(new.frase_id, new.texto);
+    END""")
+    conn.execute("""
+    CREATE TRIGGER round_results_ad AFTER DELETE ON round_results BEGIN
+      INSERT INTO phrase_search(phrase_search, rowid, texto) VALUES('delete', old.frase_id, old.texto);
+    END""")
+    conn.execute("""
+    CREATE TRIGGER round_results_au AFTER UPDATE OF frase_id, texto ON round_results BEGIN
+      INSERT INTO phrase_search(phrase_search, rowid, texto) VALUES('delete', old.frase_id, old.texto);
+      INSERT INTO phrase_search(rowid, texto) VALUES(new.frase_id, new.texto);
+    END""")
+    conn.execute("INSERT INTO phrase_search(phrase_search) VALUES('rebuild')")
+
+
+MIGRATIONS = [
+    _m001_base,
+    _m002_indexes,
+    _m003_votos_round,
+    _m004_rounds_deadline,
+    _m005_ballots,
+    _m006_screens,
+    _m007_coin_ledger,
+    _m008_round_rev,
+    _m009_player_rating,
+    _m010_rounds_archived,
+    _m011_phrase_search,
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Aplica en orden las migraciones pendientes; devuelve la versión final."""
+    version = schema_version(conn)
+    for target, step in enumerate(MIGRATIONS[version:], version + 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+    return len(MIGRATIONS)
+
+
+# ---------- Conexiones ------------------------------------------------------
+BUSY_TIMEOUT_MS = 5000
+LOCK_WAIT_MS = 1             # un BEGIN IMMEDIATE más lento que esto cuenta como espera
+
+# avisos de espera por el bloqueo de escritura: fn(segundos, timeout) para
+# loadtest.py y métricas; se llaman en el hilo que esperó
+lock_wait_hooks = []
+
+
+class _Connection(sqlite3.Connection):
+    """Conexión que recuerda su fichero: cache.py separa las entradas por base."""
+    shard = None
+
+
+class _Lease:
+    """Conexión prestada a un hilo; vuelve al pool cuando el hilo termina."""
+
+    def __init__(self, pool, conn, readonly):
+        self.conn = conn
+        weakref.finalize(self, pool._release, conn, readonly)
+
+
+class Pool:
+    """Una conexión de escritura y otra de lectura por hilo, recicladas.
+
+    Streamlit ejecuta cada rerun en su propio hilo: las conexiones se guardan
+    en un threading.local y, al morir el hilo, vuelven a una cola de ociosas
+    en lugar de cerrarse, así que abrir una por rerun no cuesta un connect.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._idle = {False: queue.SimpleQueue(), True: queue.SimpleQueue()}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _open(self, readonly):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                               factory=_Connection)
+        conn.shard = self.path
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def _release(self, conn, readonly):
+        if conn.in_transaction:
+            conn.rollback()
+        # tracing.py engancha la conexión sólo durante el rerun que la tiene
+        conn.set_trace_callback(None)
+        conn.set_progress_handler(None, 0)
+        with self._lock:
+            if not self._closed:
+                self._idle[readonly].put(conn)
+                return
+        conn.close()
+
+    def _get(self, readonly):
+        attr = "reader" if readonly else "writer"
+        lease = getattr(self._local, attr, None)
+        if lease is None:
+            try:
+                conn = self._idle[readonly].get_nowait()
+            except queue.Empty:
+                conn = self._open(readonly)
+            lease = _Lease(self, conn, readonly)
+            setattr(self._local, attr, lease)
+        return lease.conn
+
+    def writer(self):
+        return self._get(False)
+
+    def reader(self):
+        """Conexión query_only: en WAL nunca espera a los escritores."""
+        return self._get(True)
+
+    def close(self):
+        """Cierra las conexiones ociosas; las prestadas se cierran al devolverse."""
+        with self._lock:
+            self._closed = True
+        for idle in self._idle.values():
+            while True:
+                try:
+                    idle.get_nowait().close()
+                except queue.Empty:
+                    break
+
+
+def _lock_waited(seconds, timed_out):
+    for hook in lock_wait_hooks:
+        hook(seconds, timed_out)
+
+
+@contextlib.contextmanager
+def transaction(conn):
+    """BEGIN IMMEDIATE … COMMIT: toma el bloqueo de escritura desde el inicio
+    para que leer-y-luego-escribir no choque con otro escritor a mitad."""
+    t = time.perf_counter()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+    except sqlite3.OperationalError as e:
+        if "locked" in str(e):
+            _lock_waited(time.perf_counter() - t, True)
+        raise
+    waited = time.perf_counter() - t
+    if waited * 1000 >= LOCK_WAIT_MS:
+        _lock_waited(waited, False)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
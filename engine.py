@@ -0,0 +1,326 @@
+# TWOWTE – Lógica de juego sin Streamlit
+# =============================================================================
+# Todo lo que cambia el estado del juego vive aquí y recibe una conexión:
+# arranque de la base, transición de rondas, envío de frases y papeletas,
+# efectos de la tienda, premios, eliminación, resultados materializados
+# (round_results) y agregados por jugador (player_stats). app.py sólo pinta;
+# bench.py mide estas mismas funciones contra un SQLite temporal.
+# =============================================================================
+import datetime as dt
+import json
+import random
+
+import auth
+import cache
+import ledger
+import rating
+from db import migrate, transaction
+from scoring import pack_ranking, score_round
+from screens import JUDGE_SCREEN_QUERY, reset_screens
+
+DEFAULTS = {
+  "titulo": "TWOWTE – Reality de Frases",
+  "current_round": "1",
+  "reward_first": "10",
+  "reward_second": "7",
+  "reward_third": "5",
+  "reward_45": "3",
+  "reward_participate": "1",
+  "screen_size": "0",            # 0 = cada juez ordena todas las frases
+  "rating_k": "32",              # K del Elo multijugador (rating.py)
+  "archive_keep": "3"            # rondas cerradas que no pasan al archivo (archive.py)
+}
+
+REWARD_KEYS = ["reward_first", "reward_second", "reward_third", "reward_45", "reward_45"]
+
+SHOP = {"Doble Respuesta": 10, "Triple Respuesta": 25, "Desempate Favorable": 8, "Ruleta del Tigre": 9, "Duplicador de Monedas": 12}
+
+# efecto inmediato de cada objeto sobre player_round (la Ruleta va aparte)
+ITEM_EFFECTS = {
+  "Doble Respuesta": "responses_left = responses_left + 1",
+  "Triple Respuesta": "responses_left = responses_left + 2",
+  "Desempate Favorable": "df_flag = 1",
+  "Duplicador de Monedas": "multiplier = 2",
+}
+RULETA_PENALTY = 3
+
+
+class BallotRejected(Exception):
+    """La papeleta no ordena exactamente la pantalla actual del juez."""
+
+
+# ---------- Arranque y rondas -----------------------------------------------
+def bootstrap(conn, admin=None):
+    """Esquema, resultados antiguos, seed del admin, ajustes y ronda abierta."""
+    migrate(conn)
+    conn.executemany("INSERT OR IGNORE INTO settings VALUES(?,?)", DEFAULTS.items())
+    # rondas cerradas antes de existir round_results
+    backfill_results(conn)
+    # ratings que no cuentan todas las rondas (base anterior al rating o backfill)
+    if rating.needs_rebuild(conn):
+        rating.rebuild(conn, float(conn.execute("SELECT valor FROM settings WHERE clave='rating_k'").fetchone()[0]))
+    if admin and conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0:
+        conn.execute("INSERT INTO users VALUES(?,?,?,?,?)", (admin[0], auth.hash_password(admin[1]), "juez", 1, 1))
+    conn.commit()
+    return ensure_open_round(conn)
+
+
+def open_round(conn, numero):
+    """Crea la ronda `numero` con todos los usuarios activos; sin commit."""
+    conn.execute("REPLACE INTO settings VALUES('current_round',?)", (str(numero),))
+    cur = conn.execute("INSERT INTO rounds(numero,status,created_at) VALUES(?,?,?)",
+                       (numero, 'open', dt.datetime.utcnow().isoformat()))
+    conn.execute("INSERT INTO player_round(round_id, username, responses_left) "
+                 "SELECT ?, username, 1 FROM users WHERE active=1", (cur.lastrowid,))
+    return cur.lastrowid
+
+
+def touch_round(conn, round_id):
+    """Sube la revisión de la ronda para que los fragmentos en vivo recarguen."""
+    conn.execute("UPDATE rounds SET rev = rev + 1 WHERE id=?", (round_id,))
+
+
+def ensure_open_round(conn):
+    """Devuelve (id, número) de la ronda abierta, creándola si no existe."""
+    current = int(conn.execute("SELECT valor FROM settings WHERE clave='current_round'").fetchone()[0])
+    open_r = conn.execute("SELECT id FROM rounds WHERE numero=? AND status='open'", (current,)).fetchone()
+    if not open_r:
+        with transaction(conn):
+            open_r = (open_round(conn, current),)
+        cache.bump(conn)
+    return open_r[0], current
+
+
+# ---------- Acciones de jugadores y jueces ----------------------------------
+def submit_phrase(conn, round_id, username, texto, screens_mode=False):
+    """Guarda la frase y descuenta una respuesta. Devuelve un error o None."""
+    with transaction(conn):
+        if screens_mode and conn.execute("SELECT 1 FROM ballots WHERE round_id=? LIMIT 1", (round_id,)).fetchone():
+            return "La votación por pantallas ya empezó: no se aceptan más frases."
+        cur = conn.execute("UPDATE player_round SET responses_left = responses_left - 1 "
+                           "WHERE round_id=? AND username=? AND responses_left > 0", (round_id, username))
+        if cur.rowcount == 0:
+            return "No te quedan respuestas en esta ronda."
+        conn.execute("INSERT INTO frases(texto, autor, round_id) VALUES(?,?,?)", (texto, username, round_id))
+        reset_screens(conn, round_id)  # se regeneran incluyendo la frase nueva
+        touch_round(conn, round_id)
+    return None
+
+
+def submit_ballot(conn, round_id, juez, ranking, screens_mode=False):
+    """Una sola fila por (ronda, juez): reenviar reemplaza la papeleta.
+
+    En modo pantallas lanza BallotRejected si el ranking no es la pantalla
+    guardada del juez (p. ej. se regeneró al llegar una frase tras pintarla).
+    Devuelve True si con este voto ya han votado todos los jueces.
+    """
+    with transaction(conn):
+        if screens_mode:
+            screen = sorted(fid for fid, _ in conn.execute(JUDGE_SCREEN_QUERY, (round_id, juez)))
+            if not screen or screen != sorted(ranking):
+                raise BallotRejected("Tu pantalla cambió (llegó una frase nueva): vuelve a ordenarla.")
+        conn.execute("REPLACE INTO ballots(round_id, juez, ranking) VALUES(?,?,?)",
+                     (round_id, juez, pack_ranking(ranking)))
+        touch_round(conn, round_id)
+    return votes_missing(conn, round_id) == 0
+
+
+def votes_missing(conn, round_id):
+    """Jueces activos que aún no han votado en la ronda."""
+    need = conn.execute("SELECT COUNT(*) FROM users WHERE role='juez' AND active=1").fetchone()[0]
+    got = conn.execute("SELECT COUNT(*) FROM ballots WHERE round_id=?", (round_id,)).fetchone()[0]
+    return max(need - got, 0)
+
+
+PLAYER_STATE_SQL = f"""
+SELECT r.rev, r.status,
+  (SELECT responses_left FROM player_round WHERE round_id = r.id AND username = :u),
+  (SELECT item FROM purchases WHERE round_id = r.id AND username = :u LIMIT 1),
+  ({ledger.BALANCE_SQL}),
+  (SELECT json_group_array(autor) FROM (SELECT DISTINCT autor FROM frases WHERE round_id = r.id))
+FROM rounds r WHERE r.id = :rid
+"""
+
+
+def player_state(conn, round_id, username):
+    """Lo que Acción y Tienda muestran a un jugador, en una sola consulta.
+
+    rev es la revisión de la ronda leída en la misma sentencia: el estado vale
+    mientras rounds.rev no cambie. None si la ronda ya no existe.
+    """
+    row = conn.execute(PLAYER_STATE_SQL, {"rid": round_id, "u": username}).fetchone()
+    if not row:
+        return None
+    rev, status, left, bought, balance, authors = row
+    return {"rev": rev, "open": status == 'open', "responses_left": left, "bought": bought,
+            "balance": balance, "authors": set(json.loads(authors))}
+
+
+def buy(conn, username, round_id, item):
+    """Compra con efecto inmediato (no la Ruleta); lanza ledger.PurchaseRejected.
+
+    Devuelve las respuestas restantes tras el efecto.
+    """
+    with transaction(conn):
+        ledger.purchase(conn, username, round_id, item, SHOP[item])
+        left = conn.execute(f"UPDATE player_round SET {ITEM_EFFECTS[item]} WHERE round_id=? AND username=? "
+                            "RETURNING responses_left", (round_id, username)).fetchall()
+        touch_round(conn, round_id)
+    return left[0][0] if left else None
+
+
+def run_ruleta(conn, username, round_id, rival1, rival2, rng=random):
+    """Cobra la Ruleta del Tigre y resta RULETA_PENALTY a un perdedor al azar."""
+    loser = rng.choice([username, rival1, rival2])
+    with transaction(conn):
+        ledger.purchase(conn, username, round_id, "Ruleta del Tigre", SHOP["Ruleta del Tigre"], f"{rival1}|{rival2}")
+        ledger.append(conn, [(loser, -RULETA_PENALTY, "ruleta")], round_id)
+        touch_round(conn, round_id)
+    return loser
+
+
+# ---------- Cierre de ronda --------------------------------------------------
+def author_ranking(results):
+    """Autores ordenados por su mejor frase (primera aparición).
+
+    Es la clasificación de autores de todo el juego: eliminado, Victorias y
+    Promedio de Historial y rating. Antes de round_results, Historial sumaba
+    los puntos brutos de todas las frases de cada autor, sin penalización ni
+    desempate; las rondas rellenadas por backfill_results usan también esta
+    regla, así que las estadísticas antiguas pueden cambiar al actualizar.
+    """
+    best_pos = {}
+    for idx, r in enumerate(results):
+        best_pos.setdefault(r["Autor"], idx)
+    return sorted(best_pos, key=best_pos.get)
+
+
+def compute_rewards(results, settings, mults):
+    """Premio de cada frase según su puesto, por el multiplicador del autor."""
+    recomp = [int(settings[k]) for k in REWARD_KEYS]
+    participa = int(settings["reward_participate"])
+    return [(recomp[idx] if idx < len(recomp) else participa) * mults.get(r["Autor"], 1)
+            for idx, r in enumerate(results)]
+
+
+def _store_results(conn, round_id, results, rewards):
+    # DELETE explícito en vez de OR REPLACE: así saltan los triggers del índice FTS
+    conn.execute("DELETE FROM round_results WHERE round_id=?", (round_id,))
+    conn.executemany(
+        "INSERT INTO round_results VALUES(?,?,?,?,?,?,?,?,?)",
+        [(round_id, pos, r["id"], r["Autor"], r["Frase"], r["Puntos"], int(r["DF"]), r["STD"], rew)
+         for pos, (r, rew) in enumerate(zip(results, rewards), 1)])
+    ranking = author_ranking(results)
+    conn.executemany("""
+        INSERT INTO player_stats(username, rondas, victorias, suma_puestos) VALUES(?,1,?,?)
+        ON CONFLICT(username) DO UPDATE SET
+          rondas = rondas + 1,
+          victorias = victorias + excluded.victorias,
+          suma_puestos = suma_puestos + excluded.suma_puestos""",
+        [(u, int(rk == 1), rk) for rk, u in enumerate(ranking, 1)])
+    return ranking
+
+
+def close_round(conn, round_id):
+    """Cierra la ronda: paga premios, elimina, guarda resultados y abre la siguiente.
+
+    Devuelve (resultados, eliminado, número de la nueva ronda) o None si la
+    ronda no tiene frases o ya estaba cerrada. Todo ocurre en una transacción.
+    """
+    with transaction(conn):
+        # compare-and-set: sólo el primero que la encuentre abierta la cierra;
+        # los avisos repetidos salen aquí, antes de puntuar
+        if not conn.execute("SELECT 1 FROM rounds WHERE id=? AND status='open'", (round_id,)).fetchone():
+            return None
+        results = score_round(conn, round_id)
+        if not results:
+            return None
+        conn.execute("UPDATE rounds SET status='closed', rev = rev + 1 WHERE id=?", (round_id,))
+        settings = dict(conn.execute("SELECT clave, valor FROM settings").fetchall())
+        mults = dict(conn.execute("SELECT username, multiplier FROM player_round WHERE round_id=?", (round_id,)).fetchall())
+
+        # premios
+        rewards = compute_rewards(results, settings, mults)
+        ledger.append(conn, [(r["Autor"], rew, "premio") for r, rew in zip(results, rewards)], round_id)
+        ledger.snapshot(conn)
+
+        # resultados, agregados y rating; eliminado: peor "mejor" puesto
+        ranking = _store_results(conn, round_id, results, rewards)
+        rating.apply_round(conn, ranking, float(settings["rating_k"]))
+        eliminado = ranking[-1]
+        conn.execute("UPDATE users SET active=0 WHERE username=?", (eliminado,))
+
+        # preparar nueva ronda
+        next_num = conn.execute("SELECT numero FROM rounds WHERE id=?", (round_id,)).fetchone()[0] + 1
+        open_round(conn, next_num)
+    cache.bump(conn)
+    return results, eliminado, next_num
+
+
+def backfill_results(conn):
+    """Materializa rondas cerradas antes de existir round_results (sin premios)."""
+    pending = conn.execute(
+        "SELECT id FROM rounds WHERE status='closed' "
+        "AND id NOT IN (SELECT DISTINCT round_id FROM round_results) ORDER BY numero").fetchall()
+    for (rid,) in pending:
+        results = score_round(conn, rid)
+        if results:
+            _store_results(conn, rid, results, [None] * len(results))
+    if pending:
+        conn.commit()
+
+
+# ---------- Historial ---------------------------------------------------------
+def history(conn):
+    """Filas de Historial (sólo jugadores) desde los agregados materializados.
+
+    Victorias y Promedio cuentan el puesto del autor según author_ranking.
+    """
+    return [{
+        "Jugador": u,
+        "Victorias": wins,
+        "Promedio": round(suma / rondas, 2) if rondas else "-",
+        "Rating": round(elo) if rondas else "-"
+    } for u, wins, suma, rondas, elo in conn.execute(
+        "SELECT u.username, COALESCE(s.victorias, 0), COALESCE(s.suma_puestos, 0), COALESCE(s.rondas, 0), s.rating "
+        "FROM users u LEFT JOIN player_stats s ON s.username = u.username "
+        "WHERE u.role='jugador' ORDER BY u.rowid").fetchall()]
+
+
+PAGE_SIZE = 25
+
+
+def _match_query(text):
+    """Texto libre -> consulta FTS5: cada palabra como prefijo, sin operadores."""
+    return " ".join('"' + w.replace('"', '""') + '"*' for w in text.split())
+
+
+def browse_phrases(conn, query="", autor=None, numero=None, after=None, limit=PAGE_SIZE):
+    """Una página de frases puntuadas, de la ronda más reciente a la más antigua.
+
+    after es el cursor (round_id, pos) de la última fila de la página anterior
+    (paginación por clave: cada página lee sólo sus filas). Devuelve
+    (filas, cursor de la página siguiente o None).
+    """
+    where, args = [], []
+    if query.strip():
+        where.append("rr.frase_id IN (SELECT rowid FROM phrase_search WHERE phrase_search MATCH ?)")
+        args.append(_match_query(query))
+    if autor:
+        where.append("rr.autor = ?")
+        args.append(autor)
+    if numero:
+        where.append("r.numero = ?")
+        args.append(numero)
+    if after:
+        where.append("(rr.round_id < ? OR (rr.round_id = ? AND rr.pos > ?))")
+        args += [after[0], after[0], after[1]]
+    rows = conn.execute(
+        "SELECT rr.round_id, rr.pos, r.numero, rr.autor, rr.texto, rr.puntos "
+        "FROM round_results rr JOIN rounds r ON r.id = rr.round_id "
+        + ("WHERE " + " AND ".join(where) if where else "")
+        + " ORDER BY rr.round_id DESC, rr.pos LIMIT ?", (*args, limit + 1)).fetchall()
+    page = rows[:limit]
+    cursor = (page[-1][0], page[-1][1]) if len(rows) > limit else None
+    return [{"Ronda": numero, "Puesto": pos, "Autor": autor, "Frase": texto, "Puntos": puntos}
+            for _, pos, numero, autor, texto, puntos in page], cursor
@@ -0,0 +1,152 @@
+# TWOWTE – Ligas: una base SQLite por liga detrás de un router
+# =============================================================================
+# Cada liga vive en su propio fichero (LEAGUES_DIR/<liga>.db) con sus
+# usuarios, ajustes y rondas, así que las ligas no comparten el bloqueo de
+# escritura. El router abre una liga la primera vez que se pide (migraciones,
+# pool de conexiones y worker de cierre) y, con más de MAX_OPEN abiertas,
+# cierra las ociosas usadas hace más tiempo; volver a pedirla la reabre. La liga "" es
+# la base principal de siempre.
+#
+# Sólo se abren ligas cuyo fichero ya existe: crearlas es cosa del admin de
+# la liga principal (create=True), no de cualquier ?liga= en la URL.
+#
+# El lock del router sólo protege los diccionarios: la apertura (bootstrap,
+# que puede rehacer ratings) corre fuera, y quien pide una liga que se está
+# abriendo espera a su Future sin bloquear al resto. MAX_OPEN es un tope
+# blando: no se cierra una liga usada en los últimos IDLE_SECONDS ni una con
+# fecha límite pendiente (su worker debe seguir vigilándola). Los avisos al
+# worker pasan por Router.notify, que reabre la liga si hizo falta cerrarla.
+# =============================================================================
+import collections
+import concurrent.futures
+import os
+import re
+import threading
+import time
+
+from db import Pool
+from engine import bootstrap
+from worker import CloseWorker
+
+MAX_OPEN = int(os.environ.get("TWOWTE_MAX_LEAGUES", "32"))
+IDLE_SECONDS = int(os.environ.get("TWOWTE_LEAGUE_IDLE", "600"))
+LEAGUE_ID = re.compile(r"[a-z0-9][a-z0-9_-]{0,31}")
+
+
+class League:
+    """Una liga abierta: su pool y su worker de cierre."""
+
+    def __init__(self, league_id, path, admin=None):
+        self.id = league_id
+        self.pool = Pool(path)
+        bootstrap(self.pool.writer(), admin=admin)
+        self.worker = CloseWorker(self.pool).start()
+        self.last_used = time.monotonic()
+
+    def idle(self, now):
+        return now - self.last_used >= IDLE_SECONDS
+
+    def has_deadline(self):
+        """Ronda abierta con fecha límite: su worker debe seguir vigilándola."""
+        return bool(self.pool.reader().execute(
+            "SELECT 1 FROM rounds WHERE status='open' AND deadline IS NOT NULL LIMIT 1").fetchone())
+
+    def close(self):
+        self.worker.stop()
+        self.pool.close()
+
+
+class Router:
+    """Liga -> League, con apertura perezosa y expulsión LRU de las ociosas."""
+
+    def __init__(self, default_path, leagues_dir, admin=None, max_open=MAX_OPEN):
+        self.default_path = default_path
+        self.leagues_dir = leagues_dir
+        self.admin = admin
+        self.max_open = max_open
+        self._open = collections.OrderedDict()
+        self._opening = {}  # liga -> Future de la apertura en curso
+        self._lock = threading.Lock()
+        self._evicting = threading.Lock()  # una expulsión a la vez: sólo ella cierra ligas
+
+    def path(self, league_id):
+        if not league_id:
+            return self.default_path
+        if not LEAGUE_ID.fullmatch(league_id):
+            raise ValueError(f"Nombre de liga no válido: {league_id!r}")
+        return os.path.join(self.leagues_dir, f"{league_id}.db")
+
+    def known(self):
+        """Ligas con base en disco (sin la principal)."""
+        if not os.path.isdir(self.leagues_dir):
+            return []
+        return sorted(f[:-3] for f in os.listdir(self.leagues_dir)
+                      if f.endswith(".db") and LEAGUE_ID.fullmatch(f[:-3]))
+
+    def get(self, league_id, create=False):
+        """League abierta para league_id; LookupError si no existe y no se crea."""
+        path = self.path(league_id)
+        with self._lock:
+            league = self._open.get(league_id)
+            if league is not None:
+                self._open.move_to_end(league_id)
+                league.last_used = time.monotonic()
+                return league
+            future = self._opening.get(league_id)
+            owner = future is None
+            if owner:
+                if league_id and not os.path.exists(path):
+                    if not create:
+                        raise LookupError(f"Liga desconocida: {league_id}")
+                    os.makedirs(self.leagues_dir, exist_ok=True)
+                future = self._opening[league_id] = concurrent.futures.Future()
+        if not owner:
+            return future.result()
+        # la apertura (migraciones, backfill, ratings) sin el lock del router
+        try:
+            league = League(league_id, path, self.admin)
+        except BaseException as e:
+            with self._lock:
+                del self._opening[league_id]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._opening[league_id]
+            self._open[league_id] = league
+        future.set_result(league)
+        self._evict()
+        return league
+
+    def _evict(self):
+        """Cierra las ligas sobrantes ociosas y sin fecha límite, de la menos usada a la más."""
+        if not self._evicting.acquire(blocking=False):
+            return  # ya hay otra en curso
+        try:
+            self._evict_idle(time.monotonic())
+        finally:
+            self._evicting.release()
+
+    def _evict_idle(self, now):
+        with self._lock:
+            extra = len(self._open) - self.max_open
+            idle = [(lid, lg, lg.last_used) for lid, lg in self._open.items() if lg.idle(now)] if extra > 0 else []
+        # la consulta de la fecha límite, fuera del lock
+        candidates = [c for c in idle if not c[1].has_deadline()]
+        evicted = []
+        with self._lock:
+            for league_id, league, last_used in candidates:
+                if len(self._open) <= self.max_open:
+                    break
+                # sigue abierta y nadie la ha pedido mientras tanto
+                if self._open.get(league_id) is league and league.last_used == last_used:
+                    evicted.append(self._open.pop(league_id))
+        for league in evicted:
+            league.close()
+
+    def notify(self, league_id, round_id):
+        """Aviso de ronda lista al worker vivo de la liga (reabriéndola si se cerró)."""
+        self.get(league_id).worker.notify(round_id)
+
+    def open_count(self):
+        with self._lock:
+            return len(self._open)
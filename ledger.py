@@ -0,0 +1,68 @@
+# TWOWTE – Libro mayor de monedas
+# =============================================================================
+# Cada cambio de saldo (premio, compra, Ruleta, ajuste del admin) es una fila
+# que sólo se añade en coin_ledger. coin_balances guarda una foto del saldo
+# hasta cierto id del libro; se refresca al cerrar cada ronda, así que un saldo
+# es la foto más las pocas entradas posteriores (índice por usuario e id).
+# Las compras cobran con un único INSERT … SELECT … WHERE saldo >= precio.
+# =============================================================================
+import datetime as dt
+
+# saldo = foto + entradas posteriores a la foto
+BALANCE_SQL = """
+SELECT COALESCE((SELECT balance FROM coin_balances WHERE username=:u), 0)
+     + COALESCE((SELECT SUM(delta) FROM coin_ledger WHERE username=:u
+                 AND id > COALESCE((SELECT ledger_id FROM coin_balances WHERE username=:u), 0)), 0)
+"""
+
+
+class PurchaseRejected(Exception):
+    """La compra no se aplicó (saldo insuficiente o ya compró esta ronda)."""
+
+
+def _now():
+    return dt.datetime.utcnow().isoformat()
+
+
+def append(conn, entries, round_id=None):
+    """Añade movimientos [(usuario, delta, motivo)] sin tocar saldos previos."""
+    now = _now()
+    conn.executemany(
+        "INSERT INTO coin_ledger(username, delta, reason, round_id, created_at) VALUES(?,?,?,?,?)",
+        [(u, delta, reason, round_id, now) for u, delta, reason in entries if delta])
+
+
+def debit(conn, username, amount, reason, round_id=None):
+    """Cobra sólo si el saldo alcanza; una sola sentencia, atómica en SQLite."""
+    cur = conn.execute(
+        "INSERT INTO coin_ledger(username, delta, reason, round_id, created_at) "
+        "SELECT :u, -:amount, :reason, :rid, :now WHERE (" + BALANCE_SQL + ") >= :amount",
+        {"u": username, "amount": amount, "reason": reason, "rid": round_id, "now": _now()})
+    return cur.rowcount == 1
+
+
+def purchase(conn, username, round_id, item, price, meta=None):
+    """Registra la compra de la ronda y la cobra; llamar dentro de db.transaction.
+
+    Lanza PurchaseRejected (y la transacción se deshace) si ya compró esta
+    ronda o no le alcanza el saldo.
+    """
+    cur = conn.execute(
+        "INSERT INTO purchases(round_id, username, item, meta) SELECT ?,?,?,? "
+        "WHERE NOT EXISTS (SELECT 1 FROM purchases WHERE round_id=? AND username=?)",
+        (round_id, username, item, meta, round_id, username))
+    if cur.rowcount == 0:
+        raise PurchaseRejected("Ya compraste algo esta ronda.")
+    if not debit(conn, username, price, f"compra: {item}", round_id):
+        raise PurchaseRejected("Monedas insuficientes")
+
+
+def snapshot(conn):
+    """Lleva a coin_balances las entradas nuevas de todos los usuarios."""
+    conn.execute("""
+        INSERT INTO coin_balances(username, balance, ledger_id)
+        SELECT l.username, COALESCE(b.balance, 0) + SUM(l.delta), MAX(l.id)
+        FROM coin_ledger l LEFT JOIN coin_balances b ON b.username = l.username
+        WHERE l.id > COALESCE(b.ledger_id, 0)
+        GROUP BY l.username
+        ON CONFLICT(username) DO UPDATE SET balance = excluded.balance, ledger_id = excluded.ledger_id""")
@@ -0,0 +1,337 @@
+# TWOWTE – Prueba de carga con sesiones simultáneas
+# =============================================================================
+# Ejecuta app.py con streamlit.testing.v1.AppTest: cada usuario simulado es
+# una AppTest con su propio session_state. AppTest no admite reruns paralelos
+# dentro de un mismo proceso (comparte un Runtime global), así que la carga se
+# reparte entre varios procesos "agente" que atacan la misma base: dentro de
+# cada agente sus sesiones se turnan, entre agentes corren a la vez, como
+# varias réplicas del servidor (cada una con su caché y su worker de cierre;
+# cada orden del coordinador invalida la caché del agente).
+#
+# Por ronda: los jugadores entran y envían frases (y a veces compran), luego
+# los jueces ordenan y envían su papeleta; los espectadores recargan
+# Resultados e Historial sin parar, también mientras el worker cierra la ronda.
+#
+# Streamlit ejecuta el script entero en cada rerun, así que la "pestaña" de
+# cada medida es la acción que lo provocó. Las esperas por el bloqueo de
+# escritura vienen de db.lock_wait_hooks y se atribuyen a la sesión que esperó.
+# Todo corre sin red contra una base temporal (TWOWTE_DB).
+#
+#   python loadtest.py --players 40 --judges 8 --spectators 10 --agents 6
+# =============================================================================
+import argparse
+import json
+import multiprocessing as mp
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+ADMIN = ("Jlarriva", "FioreIsQueen")
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+TAB_KEY = "loadtest_tab"
+
+
+class Stats:
+    """Latencias, errores y esperas de bloqueo por pestaña de un agente."""
+
+    def __init__(self):
+        self._lock = threading.Lock()  # el worker de cierre también espera bloqueos
+        self.latency = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock_waits = defaultdict(lambda: [0, 0.0, 0])  # nº, segundos, timeouts
+        self.samples = []
+
+    def rerun(self, tab, seconds, error=None):
+        with self._lock:
+            self.latency[tab].append(seconds)
+            if error:
+                self.errors[tab] += 1
+                if len(self.samples) < 20:
+                    self.samples.append(f"{tab}: {error}")
+
+    def lock_wait(self, seconds, timed_out):
+        # se llama en el hilo que esperó: el del script lleva la pestaña en su session_state
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx(suppress_warning=True)
+        try:
+            tab = ctx.session_state[TAB_KEY] if ctx else "worker"
+        except KeyError:
+            tab = "?"
+        with self._lock:
+            w = self.lock_waits[tab]
+            w[0] += 1
+            w[1] += seconds
+            w[2] += int(timed_out)
+
+    def merge(self, other):
+        """Suma las estadísticas de otro agente (llegan como dict)."""
+        for tab, v in other["latency"].items():
+            self.latency[tab].extend(v)
+        for tab, n in other["errors"].items():
+            self.errors[tab] += n
+        for tab, (n, s, t) in other["lock_waits"].items():
+            w = self.lock_waits[tab]
+            w[0] += n
+            w[1] += s
+            w[2] += t
+        self.samples.extend(other["samples"][:20 - len(self.samples)])
+
+    def dump(self):
+        with self._lock:
+            return {"latency": dict(self.latency), "errors": dict(self.errors),
+                    "lock_waits": dict(self.lock_waits), "samples": self.samples}
+
+    def report(self):
+        out = {}
+        for tab in sorted(set(self.latency) | set(self.lock_waits)):
+            ms = np.asarray(self.latency.get(tab, []), dtype=float) * 1000
+            waits, wait_s, timeouts = self.lock_waits.get(tab, (0, 0.0, 0))
+            errors = self.errors.get(tab, 0)
+            row = {"reruns": len(ms), "errors": errors,
+                   "error_rate": round(errors / len(ms), 4) if len(ms) else 0.0,
+                   "lock_waits": waits, "lock_wait_ms": round(wait_s * 1000, 1), "lock_timeouts": timeouts}
+            if len(ms):
+                row.update({f"p{q}_ms": round(float(np.percentile(ms, q)), 1) for q in (50, 95, 99)})
+                row["max_ms"] = round(float(ms.max()), 1)
+            out[tab] = row
+        return out
+
+
+class Session:
+    """Un navegador simulado: una AppTest con su propio session_state."""
+
+    def __init__(self, stats, username, password, timeout):
+        from streamlit.testing.v1 import AppTest
+        self.stats = stats
+        self.username = username
+        self.at = AppTest.from_file(APP, default_timeout=timeout)
+        self.run("Login")
+        self.at.sidebar.text_input[0].input(username)
+        self.at.sidebar.text_input[1].input(password)
+        self.at.sidebar.button[0].click()
+        self.run("Login")
+
+    def run(self, tab):
+        self.at.session_state[TAB_KEY] = tab
+        t = time.perf_counter()
+        try:
+            self.at.run()
+            error = "; ".join(e.message for e in self.at.exception) if self.at.exception else None
+        except Exception as e:  # p. ej. el rerun superó el timeout
+            error = f"{type(e).__name__}: {e}"
+        self.stats.rerun(tab, time.perf_counter() - t, error)
+        return error is None
+
+    def button(self, label):
+        return next((b for b in self.at.button if b.label == label), None)
+
+
+def seed(path, players, judges, spectators, coins, screen_size):
+    """Base temporal con las cuentas de la prueba y monedas para la tienda."""
+    import cache
+    import engine
+    import ledger
+    from db import Pool
+
+    pool = Pool(path)
+    conn = pool.writer()
+    engine.bootstrap(conn, admin=ADMIN)
+    accounts = ([(u, "jugador") for u in players] + [(u, "juez") for u in judges]
+                + [(u, "jugador") for u in spectators])
+    conn.executemany("INSERT INTO users VALUES(?,?,?,0,1)", [(u, "x", role) for u, role in accounts])
+    conn.execute("INSERT OR IGNORE INTO player_round(round_id, username, responses_left) "
+                 "SELECT r.id, u.username, 1 FROM rounds r, users u WHERE r.status='open' AND u.active=1")
+    ledger.append(conn, [(u, coins, "carga inicial") for u, role in accounts if role == "jugador"])
+    conn.execute("REPLACE INTO settings VALUES('screen_size',?)", (str(screen_size),))
+    conn.commit()
+    cache.bump(conn)
+    return pool
+
+
+# ---------- Comportamiento de cada rol --------------------------------------
+def play(session, rid, rng, buy_rate):
+    session.run("Acción")
+    if rng.random() < buy_rate and (b := session.button("Comprar Desempate Favorable")):
+        b.click()
+        session.run("Tienda")
+    field = next((w for w in session.at.text_input if w.label == "Tu frase:"), None)
+    if field is None:  # eliminado o sin respuestas
+        return
+    field.input(f"frase {rid} de {session.username} #{rng.randrange(10**6)}")
+    session.button("Enviar frase").click()
+    session.run("Acción")
+
+
+def judge(session, conn, rid, rng):
+    session.run("Acción")  # genera la pantalla del juez si hace falta
+    ids = [r[0] for r in conn.execute(
+        "SELECT s.frase_id FROM judge_screens j JOIN screens s USING(round_id, screen) "
+        "WHERE j.round_id=? AND j.juez=? ORDER BY s.pos", (rid, session.username))]
+    if not ids:
+        ids = [r[0] for r in conn.execute("SELECT id FROM frases WHERE round_id=?", (rid,))]
+    rng.shuffle(ids)
+    try:
+        session.at.multiselect(key=f"rank_{rid}").set_value(ids)
+    except KeyError:  # sin frases que votar
+        return
+    session.run("Acción")
+    if b := session.button("Enviar voto"):
+        b.click()
+        session.run("Acción")
+
+
+def watch(sessions, stop, pause):
+    tabs = ["Resultados", "Historial"]
+    i = 0
+    while not stop.is_set():
+        sessions[i % len(sessions)].run(tabs[i % 2])
+        i += 1
+        time.sleep(pause)
+
+
+def agent(accounts, args, commands, results, stop):
+    """Proceso agente: entra con sus cuentas y obedece órdenes del coordinador.
+
+    accounts: [(usuario, contraseña, rol)] con rol 'play', 'judge' o 'watch'.
+    """
+    import cache
+    import db
+    from db import Pool
+
+    stats = Stats()
+    db.lock_wait_hooks.append(stats.lock_wait)
+    rng = random.Random(f"{args.seed}-{accounts[0][0]}")
+    sessions = {"play": [], "judge": [], "watch": []}
+    for u, p, role in accounts:
+        sessions[role].append(Session(stats, u, p, args.timeout))
+    conn = Pool(os.environ["TWOWTE_DB"]).reader()
+    results.put(("ready", None))
+
+    while True:
+        cmd, rid = commands.get()
+        # la ronda la pudo cerrar otro agente: en un único servidor ese
+        # cierre habría invalidado también esta caché
+        cache.bump()
+        if cmd == "play":
+            for s in sessions["play"]:
+                play(s, rid, rng, args.buy_rate)
+        elif cmd == "judge":
+            for s in sessions["judge"]:
+                judge(s, conn, rid, rng)
+        elif cmd == "watch":
+            watch(sessions["watch"], stop, args.think)
+        elif cmd == "done":
+            results.put(("stats", stats.dump()))
+            return
+        results.put(("ack", None))
+
+
+def _deal(items, n):
+    """Reparte items en n grupos por turnos."""
+    return [items[i::n] for i in range(n)]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Prueba de carga de app.py con AppTest")
+    ap.add_argument("--players", type=int, default=40)
+    ap.add_argument("--judges", type=int, default=8, help="además del admin, que también es juez")
+    ap.add_argument("--spectators", type=int, default=10)
+    ap.add_argument("--rounds", type=int, default=3)
+    ap.add_argument("--agents", type=int, default=6, help="procesos para jugadores y jueces")
+    ap.add_argument("--watch-agents", type=int, default=2, help="procesos para espectadores")
+    ap.add_argument("--screen-size", type=int, default=0, help="frases por pantalla de juez (0 = todas)")
+    ap.add_argument("--buy-rate", type=float, default=0.3, help="probabilidad de comprar antes de enviar")
+    ap.add_argument("--think", type=float, default=0.05, help="pausa entre recargas de espectador (s)")
+    ap.add_argument("--timeout", type=float, default=60, help="límite por rerun y por cierre (s)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="fichero JSON (por defecto, stdout)")
+    args = ap.parse_args(argv)
+
+    players = [f"p{i:03d}" for i in range(args.players)]
+    judges = [f"j{i:02d}" for i in range(args.judges)]
+    spectators = [f"s{i:02d}" for i in range(args.spectators)]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # los agentes heredan TWOWTE_DB: el router de ligas de app.py la abre como liga principal
+        os.environ["TWOWTE_DB"] = os.path.join(workdir, "load.db")
+        conn = seed(os.environ["TWOWTE_DB"], players, judges, spectators, 50, args.screen_size).reader()
+
+        ctx = mp.get_context("spawn")
+        stop = ctx.Event()
+        results = ctx.Queue()
+        crew = ([(u, "x", "play") for u in players]
+                + [(ADMIN[0], ADMIN[1], "judge")] + [(u, "x", "judge") for u in judges])
+        groups = [g for g in _deal(crew, args.agents) if g]
+        watchers = [g for g in _deal([(u, "x", "watch") for u in spectators], args.watch_agents) if g]
+        procs = []
+        for g in groups + watchers:
+            q = ctx.Queue()
+            procs.append((ctx.Process(target=agent, args=(g, args, q, results, stop), daemon=True), q))
+        t0 = time.perf_counter()
+        for p, _ in procs:
+            p.start()
+        for _ in procs:
+            results.get()  # ready
+        workers, watching = procs[:len(groups)], procs[len(groups):]
+        for _, q in watching:
+            q.put(("watch", None))
+
+        def broadcast(cmd, rid):
+            for _, q in workers:
+                q.put((cmd, rid))
+            for _ in workers:
+                results.get()  # ack
+
+        closed, close_s = [], []
+        for _ in range(args.rounds):
+            rid = conn.execute("SELECT id FROM rounds WHERE status='open'").fetchone()[0]
+            if conn.execute("SELECT COUNT(*) FROM users WHERE active=1 AND username LIKE 'p%'").fetchone()[0] < 2:
+                break
+            broadcast("play", rid)
+            broadcast("judge", rid)
+            # el último voto avisa al worker de su agente; los espectadores siguen
+            t = time.perf_counter()
+            while time.perf_counter() - t < args.timeout:
+                if conn.execute("SELECT status FROM rounds WHERE id=?", (rid,)).fetchone()[0] == "closed":
+                    closed.append(rid)
+                    close_s.append(time.perf_counter() - t)
+                    break
+                time.sleep(0.02)
+            else:
+                break
+
+        stop.set()
+        for _, q in procs:
+            q.put(("done", None))
+        stats = Stats()
+        for _ in procs:
+            kind, payload = results.get()
+            while kind != "stats":  # el ack del "watch" llega al parar
+                kind, payload = results.get()
+            stats.merge(payload)
+        for p, _ in procs:
+            p.join()
+        report = {
+            "params": vars(args),
+            "elapsed_s": round(time.perf_counter() - t0, 2),
+            "rounds_closed": len(closed),
+            "close_wait_ms": [round(s * 1000, 1) for s in close_s],
+            "tabs": stats.report(),
+            "error_samples": stats.samples,
+        }
+
+    out = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
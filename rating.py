@@ -0,0 +1,98 @@
+# TWOWTE – Rating de jugadores
+# =============================================================================
+# Elo multijugador sobre la clasificación completa de cada ronda (autores por
+# su mejor frase). Con n jugadores, cada uno puntúa S = (n - puesto) / (n - 1),
+# la fracción de rivales a los que superó, y esperaba E = media frente a cada
+# rival de 1 / (1 + 10^((Rrival - R) / SCALE)); el rating cambia K · (S - E).
+#
+# close_round lo actualiza en su transacción tocando sólo a los jugadores de
+# la ronda (player_stats.rating). rebuild() rehace la temporada desde
+# round_results, ronda a ronda con NumPy, para cuando cambia K:
+#
+#   python rating.py --db game.db --k 24
+# =============================================================================
+import argparse
+import json
+
+import numpy as np
+
+START = 1500.0
+SCALE = 400.0
+DEFAULT_K = 32
+
+
+def update(ratings, k):
+    """Ratings en orden de clasificación (mejor primero) -> ratings nuevos."""
+    r = np.asarray(ratings, dtype=float)
+    n = len(r)
+    if n < 2:
+        return r.copy()
+    # p[i, j]: probabilidad de que i quede por delante de j (diagonal 0.5)
+    p = 1.0 / (1.0 + 10.0 ** ((r[None, :] - r[:, None]) / SCALE))
+    expected = (p.sum(axis=1) - 0.5) / (n - 1)
+    actual = (n - 1 - np.arange(n)) / (n - 1)
+    return r + k * (actual - expected)
+
+
+def apply_round(conn, ranking, k):
+    """Actualiza el rating de los autores de una ronda; llamar dentro de su transacción."""
+    current = dict(conn.execute(
+        "SELECT username, rating FROM player_stats WHERE username IN (SELECT value FROM json_each(?))",
+        (json.dumps(ranking),)).fetchall())
+    new = update([current.get(u, START) for u in ranking], k)
+    conn.executemany("UPDATE player_stats SET rating=?, rated = rated + 1 WHERE username=?",
+                     zip(new.tolist(), ranking))
+
+
+def needs_rebuild(conn):
+    """True si hay rondas en player_stats que el rating no ha contado (p. ej. backfill)."""
+    rondas, rated = conn.execute("SELECT COALESCE(SUM(rondas), 0), COALESCE(SUM(rated), 0) FROM player_stats").fetchone()
+    return rondas != rated
+
+
+def rebuild(conn, k):
+    """Rehace todos los ratings repitiendo las rondas cerradas en orden; sin commit."""
+    rows = conn.execute(
+        "SELECT rr.round_id, rr.autor FROM round_results rr JOIN rounds r ON r.id = rr.round_id "
+        "WHERE r.status='closed' ORDER BY r.id, rr.pos").fetchall()
+    conn.execute("UPDATE player_stats SET rating=?, rated=0", (START,))
+    if not rows:
+        return 0
+    names, idx = np.unique([a for _, a in rows], return_inverse=True)
+    rids = np.array([rid for rid, _ in rows])
+    cuts = np.flatnonzero(np.diff(rids)) + 1
+    ratings = np.full(len(names), START)
+    rated = np.zeros(len(names), dtype=np.int64)
+    for players in np.split(idx, cuts):
+        # cada autor una vez, en el puesto de su mejor frase
+        _, first = np.unique(players, return_index=True)
+        order = players[np.sort(first)]
+        ratings[order] = update(ratings[order], k)
+        rated[order] += 1
+    conn.executemany("UPDATE player_stats SET rating=?, rated=? WHERE username=?",
+                     zip(ratings.tolist(), rated.tolist(), names.tolist()))
+    return len(cuts) + 1
+
+
+def main(argv=None):
+    from db import Pool, migrate, transaction
+
+    ap = argparse.ArgumentParser(description="Recalcula los ratings de la temporada")
+    ap.add_argument("--db", default="game.db")
+    ap.add_argument("--k", type=float, help="nuevo K (por defecto, el de settings)")
+    args = ap.parse_args(argv)
+    conn = Pool(args.db).writer()
+    migrate(conn)
+    with transaction(conn):
+        if args.k is not None:
+            conn.execute("REPLACE INTO settings VALUES('rating_k',?)", (f"{args.k:g}",))
+        row = conn.execute("SELECT valor FROM settings WHERE clave='rating_k'").fetchone()
+        k = float(row[0]) if row else DEFAULT_K
+        rounds = rebuild(conn, k)
+    print(f"{rounds} rondas repetidas con K={k:g}")
+    for u, r in conn.execute("SELECT username, rating FROM player_stats ORDER BY rating DESC LIMIT 10"):
+        print(f"{u:20} {r:7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# TWOWTE – Motor de puntuación
+# =============================================================================
+# Calcula la clasificación de una ronda con un número constante de consultas:
+# una JOIN trae frases y ajustes de player_round, otra trae las papeletas
+# (ballots) de la ronda; Puntos, STD y el desempate se resuelven en una pasada
+# NumPy sobre las papeletas desempaquetadas.
+#
+# Papeleta: una fila por (ronda, juez) con el ranking empaquetado como array
+# de ids de frase int32 little-endian, de mejor a peor (posición = índice + 1).
+#
+# En modo pantallas (screens.py) cada papeleta ordena sólo m frases: el voto
+# se normaliza a percentil q = (m - pos) / (m - 1) y Puntos es 100 · media(q).
+# Una frase sin ningún voto (su juez no llegó a votar) queda neutra, en 50,
+# y no empatada con las que su juez puso últimas.
+# =============================================================================
+import numpy as np
+
+COLUMNS = ["Autor", "Puntos", "DF", "STD", "Frase"]
+BALLOT_DTYPE = np.dtype("<i4")
+
+ROUND_QUERY = """
+SELECT f.id, f.texto, f.autor, COALESCE(pr.penalty, 0), COALESCE(pr.df_flag, 0)
+FROM frases f
+LEFT JOIN player_round pr ON pr.round_id = f.round_id AND pr.username = f.autor
+WHERE f.round_id=?
+ORDER BY f.id
+"""
+
+
+def pack_ranking(frase_ids):
+    """Ranking (ids de mejor a peor) -> BLOB para ballots.ranking."""
+    return np.asarray(frase_ids, dtype=BALLOT_DTYPE).tobytes()
+
+
+def unpack_ranking(blob):
+    return np.frombuffer(blob, dtype=BALLOT_DTYPE)
+
+
+def vote_stats(fids, rankings):
+    """Por frase (fids ordenado): nº de votos, Σ posición y Σ posición².
+
+    Ids que ya no existen en la ronda se ignoran.
+    """
+    N = len(fids)
+    if not rankings:
+        zeros = np.zeros(N, dtype=np.int64)
+        return zeros, zeros, zeros
+    ids = np.concatenate(rankings)
+    pos = np.concatenate([np.arange(1, len(r) + 1, dtype=np.int64) for r in rankings])
+    idx = np.searchsorted(fids, ids)
+    ok = (idx < N) & (fids[np.minimum(idx, N - 1)] == ids)
+    idx, pos = idx[ok], pos[ok]
+    n = np.bincount(idx, minlength=N)
+    s = np.bincount(idx, weights=pos, minlength=N).astype(np.int64)
+    s2 = np.bincount(idx, weights=pos * pos, minlength=N).astype(np.int64)
+    return n, s, s2
+
+
+def percentile_stats(fids, rankings):
+    """Por frase (fids ordenado): nº de votos, Σ q y Σ q² con q percentil en su pantalla."""
+    N = len(fids)
+    if not rankings:
+        zeros = np.zeros(N)
+        return zeros.astype(np.int64), zeros, zeros
+    ids = np.concatenate(rankings)
+    q = np.concatenate([np.linspace(1.0, 0.0, len(r)) if len(r) > 1 else np.ones(len(r)) for r in rankings])
+    idx = np.searchsorted(fids, ids)
+    ok = (idx < N) & (fids[np.minimum(idx, N - 1)] == ids)
+    idx, q = idx[ok], q[ok]
+    return (np.bincount(idx, minlength=N),
+            np.bincount(idx, weights=q, minlength=N),
+            np.bincount(idx, weights=q * q, minlength=N))
+
+
+def score_round(conn, round_id):
+    """Devuelve los resultados de la ronda ordenados de mejor a peor.
+
+    Cada fila es un dict con id, Autor, Puntos, DF, STD y Frase; el orden es
+    (Puntos, DF, STD) descendente y, a igualdad, el de envío de la frase.
+    Si la ronda se votó por pantallas, los votos se normalizan a percentil.
+    """
+    rows = conn.execute(ROUND_QUERY, (round_id,)).fetchall()
+    if not rows:
+        return []
+    N = len(rows)
+    fids = np.array([r[0] for r in rows], dtype=np.int64)
+    pen = np.array([r[3] for r in rows], dtype=np.int64)
+    df = np.array([r[4] for r in rows], dtype=np.int64)
+    rankings = [unpack_ranking(b) for (b,) in conn.execute(
+        "SELECT ranking FROM ballots WHERE round_id=?", (round_id,))]
+    if conn.execute("SELECT 1 FROM screens WHERE round_id=? LIMIT 1", (round_id,)).fetchone():
+        n, sq, sq2 = percentile_stats(fids, rankings)
+        # Puntos = 100 · percentil medio + penalización; STD en la misma escala;
+        # sin votos, percentil 0.5 y STD 0
+        media = np.divide(sq, n, out=np.full(N, 0.5), where=n > 0)
+        puntos = np.round(100 * media, 2) + pen
+        var = np.maximum(np.divide(sq2, n, out=media * media, where=n > 0) - media * media, 0)
+        std = 100 * np.sqrt(var)
+    else:
+        n, s, s2 = vote_stats(fids, rankings)
+        # Puntos = Σ (N + 1 - pos) + penalización
+        puntos = n * (N + 1) - s + pen
+        # STD poblacional de las posiciones: sqrt(n·Σx² - (Σx)²) / n (exacto en enteros)
+        var_n2 = np.maximum(n * s2 - s * s, 0)
+        std = np.divide(np.sqrt(var_n2), n, out=np.zeros(N), where=n > 0)
+
+    # lexsort es estable y usa la última clave como primaria
+    orden = np.lexsort((-std, -df, -puntos))
+    return [{
+        "id": rows[i][0],
+        "Autor": rows[i][2],
+        "Puntos": puntos[i].item(),
+        "DF": bool(df[i]),
+        "STD": float(std[i]),
+        "Frase": rows[i][1],
+    } for i in orden]
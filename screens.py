@@ -0,0 +1,94 @@
+# TWOWTE – Modo pantallas (como el TWOW clásico)
+# =============================================================================
+# Con screen_size = k > 0 cada juez ordena sólo una "pantalla" de k frases.
+# Hay una pantalla por juez activo; si J jueces no alcanzan a ver las N
+# frases con k por cabeza, la pantalla crece a ⌈N/J⌉ para que toda frase
+# tenga al menos un juez. Las pantallas se solapan de forma equilibrada: se
+# recorren permutaciones aleatorias de todas las frases, así cada frase
+# aparece en ⌈J·k/N⌉ o ⌊J·k/N⌋ pantallas. Se calculan una vez por ronda (al
+# abrir la votación) y se guardan; pintar la página de un juez es una
+# consulta O(k).
+# =============================================================================
+import random
+
+from db import transaction
+
+JUDGE_SCREEN_QUERY = """
+SELECT f.id, f.texto
+FROM judge_screens js
+JOIN screens s ON s.round_id = js.round_id AND s.screen = js.screen
+JOIN frases f ON f.id = s.frase_id
+WHERE js.round_id=? AND js.juez=?
+ORDER BY s.pos
+"""
+
+
+def build_screens(frase_ids, n_screens, k, rng=random):
+    """n_screens listas de min(k, N) ids distintos, con apariciones equilibradas."""
+    k = min(k, len(frase_ids))
+    stream, screens = [], []
+    for _ in range(n_screens):
+        screen, deferred = [], []
+        while len(screen) < k:
+            if not stream:
+                stream = list(frase_ids)
+                rng.shuffle(stream)
+            fid = stream.pop()
+            # un id repetido al empalmar dos permutaciones se guarda para la siguiente
+            (deferred if fid in screen else screen).append(fid)
+        stream.extend(deferred)
+        screens.append(screen)
+    return screens
+
+
+def ensure_screens(conn, round_id, k):
+    """Genera y guarda las pantallas de la ronda si aún no existen."""
+    with transaction(conn):
+        if conn.execute("SELECT 1 FROM screens WHERE round_id=? LIMIT 1", (round_id,)).fetchone():
+            return
+        fids = [r[0] for r in conn.execute("SELECT id FROM frases WHERE round_id=? ORDER BY id", (round_id,))]
+        if not fids:
+            return
+        judges = [r[0] for r in conn.execute("SELECT username FROM users WHERE role='juez' AND active=1 ORDER BY username")]
+        # una pantalla por juez, tan grande como haga falta para cubrirlas todas
+        n_screens = max(len(judges), 1)
+        screens = build_screens(fids, n_screens, max(k, -(-len(fids) // n_screens)))
+        missing = set(fids).difference(*screens)
+        if missing:
+            raise RuntimeError(f"Pantallas sin cubrir las frases {sorted(missing)} de la ronda {round_id}")
+        conn.executemany("INSERT INTO screens(round_id, screen, pos, frase_id) VALUES(?,?,?,?)",
+                         [(round_id, sc, pos, fid) for sc, ids in enumerate(screens) for pos, fid in enumerate(ids)])
+        order = list(range(n_screens))
+        random.shuffle(order)
+        conn.executemany("INSERT INTO judge_screens(round_id, juez, screen) VALUES(?,?,?)",
+                         [(round_id, j, order[i % n_screens]) for i, j in enumerate(judges)])
+
+
+def _assign_late_judge(conn, round_id, juez):
+    """Juez sin pantalla (alta posterior): la pantalla con menos jueces."""
+    with transaction(conn):
+        row = conn.execute("""
+            SELECT s.screen FROM (SELECT DISTINCT screen FROM screens WHERE round_id=?) s
+            LEFT JOIN judge_screens js ON js.round_id=? AND js.screen = s.screen
+            GROUP BY s.screen ORDER BY COUNT(js.juez), s.screen LIMIT 1""", (round_id, round_id)).fetchone()
+        if row:
+            conn.execute("INSERT OR IGNORE INTO judge_screens(round_id, juez, screen) VALUES(?,?,?)",
+                         (round_id, juez, row[0]))
+
+
+def judge_screen(conn, round_id, juez, k):
+    """[(id, texto)] de la pantalla del juez, generándola la primera vez."""
+    rows = conn.execute(JUDGE_SCREEN_QUERY, (round_id, juez)).fetchall()
+    if not rows:
+        ensure_screens(conn, round_id, k)
+        rows = conn.execute(JUDGE_SCREEN_QUERY, (round_id, juez)).fetchall()
+        if not rows:
+            _assign_late_judge(conn, round_id, juez)
+            rows = conn.execute(JUDGE_SCREEN_QUERY, (round_id, juez)).fetchall()
+    return rows
+
+
+def reset_screens(conn, round_id):
+    """Descarta las pantallas (p. ej. llegó una frase nueva antes de votar)."""
+    conn.execute("DELETE FROM screens WHERE round_id=?", (round_id,))
+    conn.execute("DELETE FROM judge_screens WHERE round_id=?", (round_id,))
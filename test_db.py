@@ -0,0 +1,70 @@
+# TWOWTE – Planes de consulta de las lecturas calientes
+# =============================================================================
+# Tras migrate(), cada consulta que se repite en los reruns debe resolverse
+# con SEARCH sobre un índice (o la clave primaria), nunca con SCAN de una
+# tabla entera. El antes/después: con sólo el esquema original
+# (MIGRATIONS[:1]) las consultas originales recorren la tabla entera y, al
+# terminar migrate(), las mismas usan índice. Se ejecuta con:
+# python -m pytest -q
+# =============================================================================
+import re
+
+import pytest
+
+import engine
+from db import MIGRATIONS, Pool, migrate
+from scoring import ROUND_QUERY
+
+HOT_QUERIES = {
+    "player_state": (engine.PLAYER_STATE_SQL, {"rid": 1, "u": "ana"}),
+    "ballots_by_round": ("SELECT juez, ranking FROM ballots WHERE round_id=?", (1,)),
+    "purchases_round_user": ("SELECT item FROM purchases WHERE round_id=? AND username=?", (1, "ana")),
+    "frases_by_round": ("SELECT id, texto FROM frases WHERE round_id=?", (1,)),
+    "round_scoring": (ROUND_QUERY, (1,)),
+    "open_round": ("SELECT id, numero FROM rounds WHERE status='open' ORDER BY numero DESC LIMIT 1", ()),
+}
+
+# consultas calientes del app.py original, antes de los índices
+ORIGINAL_QUERIES = {
+    "frases_by_round": HOT_QUERIES["frases_by_round"],
+    "purchases_round_user": HOT_QUERIES["purchases_round_user"],
+    "open_round": HOT_QUERIES["open_round"],
+}
+
+# SCAN de una tabla; SCAN CONSTANT ROW y SCAN (subquery-n) no leen tablas
+TABLE_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW|\(subquery)")
+
+
+def _plan(conn, sql, args):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, args)]
+
+
+@pytest.fixture(scope="module")
+def conn(tmp_path_factory):
+    conn = Pool(str(tmp_path_factory.mktemp("db") / "plans.db")).writer()
+    engine.bootstrap(conn)
+    return conn
+
+
+@pytest.mark.parametrize("name", HOT_QUERIES)
+def test_hot_query_uses_index(conn, name):
+    plan = _plan(conn, *HOT_QUERIES[name])
+    assert not [step for step in plan if TABLE_SCAN.match(step)], plan
+    assert any(step.startswith("SEARCH") and ("INDEX" in step or "PRIMARY KEY" in step) for step in plan), plan
+
+
+def test_migrations_replace_scans_with_index_searches(tmp_path):
+    conn = Pool(str(tmp_path / "before.db")).writer()
+    conn.execute("BEGIN IMMEDIATE")
+    MIGRATIONS[0](conn)
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    for name, (sql, args) in ORIGINAL_QUERIES.items():
+        plan = _plan(conn, sql, args)
+        assert [step for step in plan if TABLE_SCAN.match(step)], (name, plan)
+
+    migrate(conn)
+    for name, (sql, args) in ORIGINAL_QUERIES.items():
+        plan = _plan(conn, sql, args)
+        assert not [step for step in plan if TABLE_SCAN.match(step)], (name, plan)
+        assert any(step.startswith("SEARCH") for step in plan), (name, plan)
@@ -0,0 +1,47 @@
+# TWOWTE – Estrés del pool de conexiones (WAL)
+# =============================================================================
+# SESSIONS hilos a la vez, cada uno con su escritor y su lector del pool,
+# como los reruns de Streamlit: ninguna escritura puede fallar con "database
+# is locked" y, al terminar los hilos, sus conexiones vuelven a las ociosas.
+# =============================================================================
+import gc
+import threading
+
+import engine
+from db import Pool, transaction
+
+SESSIONS = 60
+OPS = 20
+
+
+def test_concurrent_sessions_never_hit_locked(tmp_path):
+    path = str(tmp_path / "pool.db")
+    pool = Pool(path)
+    rid = engine.bootstrap(pool.writer())[0]
+    main_reader = pool.reader()  # el hilo principal conserva la suya
+    errors, writers, readers = [], set(), set()
+
+    def session(i):
+        w, r = pool.writer(), pool.reader()
+        writers.add(id(w))
+        readers.add(id(r))
+        try:
+            for k in range(OPS):
+                with transaction(w):
+                    w.execute("INSERT INTO frases(texto, autor, round_id) VALUES(?,?,?)", (f"c{i}-{k}", f"s{i}", rid))
+                r.execute("SELECT COUNT(DISTINCT autor) FROM frases WHERE round_id=?", (rid,)).fetchone()
+        except Exception as e:  # noqa: BLE001 - se informa abajo
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(SESSIONS)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    gc.collect()
+
+    assert errors == []
+    assert main_reader.execute("SELECT COUNT(*) FROM frases").fetchone()[0] == SESSIONS * OPS
+    # todas las conexiones de los hilos terminados, de vuelta en la cola de ociosas
+    assert pool._idle[False].qsize() == len(writers)
+    assert pool._idle[True].qsize() == len(readers)
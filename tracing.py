@@ -0,0 +1,170 @@
+# TWOWTE – Trazas SQL y tiempos por rerun
+# =============================================================================
+# Con el trazado activo, cada rerun engancha sus conexiones con
+# sqlite3.Connection.set_trace_callback y atribuye cada sentencia a la sección
+# (pestaña) que se está pintando. SQLite no informa de cuánto dura cada
+# sentencia: un progress handler anota la última vez que la VM trabajó, y la
+# duración va del inicio de la sentencia a ese instante (incluye leer las
+# filas, no el pintado posterior; sentencias de menos de PROGRESS_OPS
+# instrucciones cuentan como 0). Cada rerun queda en un buffer circular de
+# proceso que lee el panel Admin.
+#
+# Las sentencias se guardan normalizadas (literales -> ?), así que no quedan
+# valores de usuario en memoria y las repeticiones se pueden contar: la misma
+# sentencia muchas veces en una sección suele ser un patrón N+1.
+#
+# Apagado, begin() sólo quita los callbacks de las conexiones y section() no
+# mide nada.
+# =============================================================================
+import collections
+import contextlib
+import datetime as dt
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+RING_SIZE = 200
+PROGRESS_OPS = 100        # instrucciones de la VM entre marcas de tiempo
+REPEAT_THRESHOLD = 5      # veces por sección a partir de las que se marca un posible N+1
+INICIO = "Inicio"         # lo que se ejecuta fuera de cualquier sección
+
+enabled = os.environ.get("TWOWTE_TRACE") == "1"
+_lock = threading.Lock()
+_ring = collections.deque(maxlen=RING_SIZE)
+
+_LITERALS = re.compile(r"\bX'[0-9A-Fa-f]*'|'(?:[^']|'')*'|-?\b\d+(?:\.\d+)?\b")
+
+
+def normalize(sql):
+    """Sentencia sin literales ni espacios repetidos."""
+    return " ".join(_LITERALS.sub("?", sql).split())
+
+
+def set_enabled(flag):
+    global enabled
+    enabled = bool(flag)
+
+
+def clear():
+    with _lock:
+        _ring.clear()
+
+
+class _Off:
+    """Rerun sin trazar: las secciones no hacen nada."""
+
+    @contextlib.contextmanager
+    def section(self, name):
+        yield
+
+
+_OFF = _Off()
+
+
+class Rerun:
+    """Trazas de un rerun; sólo lo usa el hilo que ejecuta el script."""
+
+    def __init__(self, user, conns):
+        self._t0 = self._mark = time.perf_counter()
+        self._current = INICIO
+        self._events = []   # [sección, inicio, sql, fin]
+        self._done = 0      # eventos ya agregados
+        self._tick = 0.0    # última actividad de la VM
+        self.record = {"at": dt.datetime.utcnow().isoformat(timespec="seconds"), "user": user,
+                       "total_ms": 0.0, "sections": {}, "statements": []}
+        for conn in conns:
+            conn.set_trace_callback(self._trace)
+            conn.set_progress_handler(self._progress, PROGRESS_OPS)
+        with _lock:
+            _ring.append(self.record)
+
+    def _close_last(self):
+        # la sentencia anterior terminó en la última marca de la VM posterior a su inicio
+        if self._events and self._events[-1][3] is None:
+            last = self._events[-1]
+            last[3] = max(self._tick, last[1])
+
+    def _trace(self, sql):
+        self._close_last()
+        self._events.append([self._current, time.perf_counter(), sql, None])
+
+    def _progress(self):
+        self._tick = time.perf_counter()
+
+    def _flush(self, now, ms=None):
+        """Agrega los eventos pendientes y el tiempo de la sección que termina."""
+        self._close_last()
+        events, start = self._events, self._done
+        self._done = len(events)
+        with _lock:
+            sections = self.record["sections"]
+            for name, t, sql, end in events[start:]:
+                sections.setdefault(name, {"ms": 0.0, "queries": 0})["queries"] += 1
+                self.record["statements"].append((name, normalize(sql), (end - t) * 1000))
+            if ms is not None:
+                name, elapsed = ms
+                sections.setdefault(name, {"ms": 0.0, "queries": 0})["ms"] += elapsed * 1000
+            self.record["total_ms"] = (now - self._t0) * 1000
+
+    @contextlib.contextmanager
+    def section(self, name):
+        start = time.perf_counter()
+        # lo ocurrido desde la última sección cuenta como Inicio
+        self._flush(start, (INICIO, start - self._mark))
+        self._current = name
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self._flush(end, (name, end - start))
+            self._current = INICIO
+            self._mark = end
+
+
+def begin(user, *conns):
+    """Empieza a trazar un rerun (o quita el callback si el trazado está apagado)."""
+    if not enabled:
+        for conn in conns:
+            conn.set_trace_callback(None)
+            conn.set_progress_handler(None, 0)
+        return _OFF
+    return Rerun(user, conns)
+
+
+def summary(exclude=None):
+    """Agregados del buffer para el panel Admin: secciones, lentas y repeticiones."""
+    with _lock:
+        records = [r for r in _ring if r is not exclude]
+        per_section = collections.defaultdict(lambda: ([], []))
+        totals, slowest, repeats = [], [], {}
+        for r in records:
+            totals.append(r["total_ms"])
+            for name, sec in r["sections"].items():
+                per_section[name][0].append(sec["ms"])
+                per_section[name][1].append(sec["queries"])
+            slowest.extend(r["statements"])
+            counts = collections.Counter((name, sql) for name, sql, _ in r["statements"])
+            for key, n in counts.items():
+                if n >= REPEAT_THRESHOLD:
+                    worst, seen = repeats.get(key, (0, 0))
+                    repeats[key] = (max(worst, n), seen + 1)
+
+    def row(name, ms, queries):
+        ms = np.asarray(ms)
+        return {"Sección": name, "Reruns": len(ms), "p50 ms": round(float(np.percentile(ms, 50)), 1),
+                "p95 ms": round(float(np.percentile(ms, 95)), 1), "Consultas/rerun": round(float(np.mean(queries)), 1)}
+
+    sections = [row(name, ms, q) for name, (ms, q) in sorted(per_section.items())]
+    if totals:
+        sections.append(row("Total", totals, [len(r["statements"]) for r in records]))
+    return {
+        "reruns": len(records),
+        "sections": sections,
+        "slowest": [{"ms": round(ms, 2), "Sección": name, "Sentencia": sql}
+                    for name, sql, ms in sorted(slowest, key=lambda s: s[2], reverse=True)[:10]],
+        "repeats": [{"Sección": name, "Sentencia": sql, "Máx. por rerun": worst, "Reruns": seen}
+                    for (name, sql), (worst, seen) in sorted(repeats.items(), key=lambda kv: -kv[1][0])],
+    }
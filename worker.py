@@ -0,0 +1,79 @@
+# TWOWTE – Cierre de rondas en segundo plano
+# =============================================================================
+# Un único hilo por proceso cierra las rondas. Recibe avisos de "ronda lista"
+# cuando se confirma el último voto y, cada POLL_SECONDS, revisa las rondas con
+# fecha límite vencida. El cierre en sí es un compare-and-set sobre
+# rounds.status dentro de engine.close_round, así que un aviso repetido (o un
+# cierre manual del admin a la vez) nunca paga dos veces. Tras cada cierre
+# pasa al archivo frío las rondas cerradas que exceden archive_keep.
+# =============================================================================
+import datetime as dt
+import logging
+import queue
+import threading
+
+import archive
+from engine import close_round, votes_missing
+
+log = logging.getLogger(__name__)
+
+POLL_SECONDS = 15
+
+
+class CloseWorker:
+    def __init__(self, pool, poll_seconds=POLL_SECONDS):
+        self.pool = pool
+        self.poll_seconds = poll_seconds
+        self._jobs = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="twowte-close-worker", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def notify(self, round_id):
+        """Aviso de que la ronda puede estar lista para cerrarse."""
+        self._jobs.put(round_id)
+
+    def stop(self):
+        """Termina el hilo tras el trabajo en curso (liga cerrada por el router)."""
+        self._stop.set()
+        self._jobs.put(None)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                round_id = self._jobs.get(timeout=self.poll_seconds)
+            except queue.Empty:
+                round_id = None
+            if self._stop.is_set():
+                break
+            try:
+                conn = self.pool.writer()
+                if round_id is not None and votes_missing(conn, round_id) == 0:
+                    self._close(conn, round_id, "votos completos")
+                self._close_expired(conn)
+            except Exception:
+                log.exception("Fallo cerrando la ronda %s", round_id)
+
+    def _close(self, conn, round_id, motivo):
+        closed = close_round(conn, round_id)
+        if closed:
+            log.info("Ronda %s cerrada (%s). Eliminado: %s", closed[2] - 1, motivo, closed[1])
+            moved = archive.after_close(conn)
+            if moved:
+                log.info("%s rondas pasadas al archivo", moved)
+
+    def _close_expired(self, conn):
+        now = dt.datetime.utcnow().isoformat()
+        expired = conn.execute(
+            "SELECT id FROM rounds WHERE status='open' AND deadline IS NOT NULL AND deadline <= ?",
+            (now,)).fetchall()
+        for (rid,) in expired:
+            if conn.execute("SELECT 1 FROM frases WHERE round_id=? LIMIT 1", (rid,)).fetchone():
+                self._close(conn, rid, "fecha límite")
+            else:
+                # sin frases no hay nada que cerrar: se descarta la fecha
+                conn.execute("UPDATE rounds SET deadline=NULL WHERE id=?", (rid,))
+                conn.commit()